@@ -1,247 +1,356 @@
 # Flask backend (query interface + SQLite + PDF generation + Ollama LLM parser)
-print("✅ Starting app.py — deployed version")
+import logging
+import os
+
+# LOG_LEVEL=DEBUG brings back the per-request parse/fetch detail; below the level it costs nothing
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="[%(levelname)s] %(name)s: %(message)s"
+)
+log = logging.getLogger("app")
+log.info("✅ Starting app.py — deployed version")
 
-from flask import Flask, request, jsonify, send_file, url_for, send_from_directory, abort
+from flask import Flask, Response, request, jsonify, send_file, url_for, send_from_directory, abort, g, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import json
-from fpdf import FPDF
-import os
 import subprocess
-import uuid
+import time
 from werkzeug.middleware.proxy_fix import ProxyFix
 import re
 import requests
+import urllib3
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from query_parser import clamp_limit, parse_locally
+from curriculum import build_parse_prompt, lookup_topic
+import db
+from db import DB_PATH, get_connection, transaction
+from catalog import Catalog
+from pdf_builder import PdfJobs, pdf_filename
+from sampler import QuestionSampler
+import migrations
+import image_variants
+import session_store
+import janitor
+import metrics
+from query_cache import QueryCache, normalize_query
+import singleflight
+from breaker import CircuitBreaker
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
-FIREWORKS_URL = "https://api.fireworks.ai/inference/v1/chat/completions"
 load_dotenv()
+# Overridable so benchmarks can point the parser at a local stand-in
+FIREWORKS_URL = os.getenv("FIREWORKS_URL", "https://api.fireworks.ai/inference/v1/chat/completions")
 api_key = os.getenv("FIREWORKS_API_KEY")
 if not api_key:
-    print("[WARN] FIREWORKS_API_KEY not set; parsing will fail on first request")
+    log.warning("FIREWORKS_API_KEY not set; parsing will fail on first request")
 FIREWORKS_HEADERS = {
     "Accept": "application/json",
     "Authorization": f"Bearer {api_key}",
     "Content-Type": "application/json"
 }
+# Every parse call has to finish inside LLM_BUDGET_S, retries included; shared with asgi.py
+LLM_CONNECT_TIMEOUT_S = float(os.getenv("LLM_CONNECT_TIMEOUT", "3"))
+LLM_READ_TIMEOUT_S = float(os.getenv("LLM_READ_TIMEOUT", "8"))
+LLM_BUDGET_S = float(os.getenv("LLM_BUDGET", "10"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "1"))
+LLM_RETRY_STATUSES = (502, 503, 504)
+# This many failed or slower-than-LLM_SLOW_CALL calls in a row send parsing to the local parser
+# for LLM_BREAKER_COOLDOWN seconds, after which one probe call decides whether to resume
+llm_breaker = CircuitBreaker(
+    "fireworks",
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    cooldown_s=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+    slow_call_s=float(os.getenv("LLM_SLOW_CALL", "5"))
+)
 session = requests.Session()
 session.headers.update({"Connection": "keep-alive"})
 
+# No urllib3 retries: they would stack on top of the timeouts; _post_llm retries within the budget
 adapter = HTTPAdapter(
     pool_connections=20,
     pool_maxsize=20,
-    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504))
+    max_retries=0
 )
 
 session.mount("http://", adapter)
 session.mount("https://", adapter)
 
-CORS(app, resources={r"/api/*": {"origins": [
+CORS_ORIGINS = [
     "http://localhost:5173",
     "https://*.ngrok-free.app",
     "https://perfectly-knowing-cow.ngrok-free.app",
     "https://nystateregentsprep.netlify.app"
-]}}, supports_credentials=True)
+]
+CORS_EXPOSE_HEADERS = ["ETag", "X-History-Before", "X-History-Since", "X-History-More", "X-Query-Parser"]
+CORS(app, resources={r"/api/*": {"origins": CORS_ORIGINS}}, supports_credentials=True,
+     expose_headers=CORS_EXPOSE_HEADERS)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # /regents-quiz/backend
-DB_PATH = os.path.abspath(os.path.join(BASE_DIR, "regentsqs.db"))
 IMG_DIR = os.path.join(os.path.dirname(__file__), "static") # /regents-quiz/backend/static/images
 PDF_DIR = os.path.abspath(os.path.join(BASE_DIR, "pdfs"))  # /regents-quiz/backend/pdfs
-OUTPUT_PDF_DIR = os.path.abspath(os.path.join(BASE_DIR, "output_pdf")) # /regents-quiz/backend/output_pdf
+OUTPUT_PDF_DIR = os.path.abspath(os.getenv("OUTPUT_PDF_DIR") or os.path.join(BASE_DIR, "output_pdf")) # /regents-quiz/backend/output_pdf
 os.makedirs(PDF_DIR, exist_ok=True)
+# Below this the local parser's answer is discarded and the LLM is asked instead
+LOCAL_PARSE_MIN_CONFIDENCE = float(os.getenv("LOCAL_PARSE_MIN_CONFIDENCE", "0.75"))
+catalog = Catalog()
+pdf_jobs = PdfJobs(OUTPUT_PDF_DIR, max_workers=int(os.getenv("PDF_WORKERS", "2")))
+# How long /api/download holds a request open for a PDF that is still rendering
+PDF_WAIT_TIMEOUT_S = float(os.getenv("PDF_WAIT_TIMEOUT", "20"))
+# Messages per /api/history page when the client doesn't pass ?limit, and the most it may ask for
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 200
+# ?stream=<mode> or the matching Accept type turns /api/query into a stream of events
+STREAM_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+sampler = QuestionSampler(catalog)
+KNOWN_INTENTS = {"generate", "list_topics", "count_questions"}
+# Set PARSE_CACHE_DB to a file path to share parsed queries between gunicorn workers
+parse_cache = QueryCache(
+    maxsize=int(os.getenv("PARSE_CACHE_SIZE", "2048")),
+    ttl=int(os.getenv("PARSE_CACHE_TTL", "86400")),
+    db_path=os.getenv("PARSE_CACHE_DB") or None
+)
+# Identical LLM parses in flight at the same time share one call
+parse_flights = singleflight.SingleFlight("parse")
 
 def init_db():
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS questions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        subject TEXT NOT NULL,
-        topic TEXT NOT NULL,
-        month TEXT NOT NULL,
-        year INTEGER NOT NULL,
-        type TEXT NOT NULL,
-        question_image_path TEXT NOT NULL,
-        correct_answer TEXT,
-        explanation TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS sessions (
-        session_id   TEXT PRIMARY KEY,
-        started_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        last_active  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );)
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS session_messages (
-        id           INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id   TEXT    NOT NULL,
-        sender       TEXT    NOT NULL,
-        text         TEXT    NOT NULL,
-        created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(session_id) REFERENCES sessions(session_id)
-            ON DELETE CASCADE
-        );
-    """)
-    cursor.execute("""
-    CREATE TABLE session_questions (
-        session_id    TEXT    NOT NULL,
-        message_idx   INTEGER NOT NULL,
-        question_idx  INTEGER NOT NULL,
-        question_id   INTEGER NOT NULL,
-        question_data TEXT    NOT NULL,
-        PRIMARY KEY (session_id, message_idx, question_idx),
-        FOREIGN KEY (session_id, message_idx)
-            REFERENCES session_messages(session_id, id)
-            ON DELETE CASCADE
-    );
-""")
-    conn.commit()
+    version = migrations.migrate(conn)
+    log.info("database schema at version %s", version)
+    # Loaded before workers fork so they share the snapshot copy-on-write
+    catalog.load(conn)
     conn.close()
 
+# Runs once in the gunicorn master with --preload, before workers fork
+init_db()
+
+def _idle_http_connections():
+    # urllib3 pools hold None placeholders for slots that have no open connection
+    pools = adapter.poolmanager.pools
+    return sum(
+        sum(conn is not None for conn in list(pools[key].pool.queue))
+        for key in list(pools.keys()) if key in pools
+    )
+
+# Read at scrape time from the stats the components already keep
+metrics.Gauge("regents_parse_cache_entries", "Parsed queries held in this worker's cache",
+              collect=lambda: parse_cache.stats()["size"])
+metrics.Counter("regents_parse_cache_lookups_total", "Parse cache lookups by result", labels=("result",),
+                collect=lambda: {(k,): parse_cache.stats()[k] for k in ("hits", "misses", "shared_hits")})
+metrics.Counter("regents_sqlite_connections_total", "Thread-local SQLite handles opened or reused",
+                labels=("event",), collect=lambda: {(k,): db.stats()[k] for k in ("opened", "reused")})
+metrics.Counter("regents_sqlite_busy_waits_total", "Write transactions that waited for the lock",
+                collect=lambda: db.stats()["busy_waits"])
+metrics.Gauge("regents_http_pool_idle_connections", "Idle keep-alive connections to Fireworks",
+              collect=_idle_http_connections)
+metrics.Gauge("regents_pdf_jobs_in_flight", "PDF renders queued or running in this worker",
+              collect=lambda: pdf_jobs.in_flight())
+metrics.Gauge("regents_session_write_queue_depth", "Session writes waiting for the group-commit writer",
+              collect=lambda: session_store.stats().get("queue_depth", 0))
+metrics.Gauge("regents_llm_breaker_state", "1 for the Fireworks circuit breaker's current state",
+              labels=("state",), collect=lambda: {(st,): int(llm_breaker.stats()["state"] == st)
+                                                  for st in ("closed", "open", "half_open")})
+metrics.Counter("regents_llm_breaker_rejected_total", "Parses sent to the local parser because the breaker was open",
+                collect=lambda: llm_breaker.stats()["rejected"])
+metrics.Counter("regents_llm_breaker_opens_total", "Times the Fireworks circuit breaker opened",
+                collect=lambda: llm_breaker.stats()["opens"])
+metrics.Gauge("regents_catalog_questions", "Questions in the in-memory catalogue",
+              collect=lambda: catalog.count("", "", ""))
+
+@app.before_request
+def start_janitor():
+    # Started lazily so the thread lives in each forked worker, not the --preload master
+    janitor.ensure_started(OUTPUT_PDF_DIR)
+    g.started_at = time.perf_counter()
+
+@app.after_request
+def report_parser(response):
+    # Lets clients and logs see which parser handled an /api/query request
+    parsed_by = g.get("parsed_by")
+    if parsed_by:
+        response.headers["X-Query-Parser"] = parsed_by
+    if "started_at" in g:
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - g.started_at,
+            endpoint=request.endpoint or "unmatched", method=request.method, status=response.status_code
+        )
+    return response
+
+@app.teardown_request
+def release_db(exc):
+    db.release()
+
 @app.get("/healthz")
 def healthz():
-    return {"status": "alive"}, 200
-
-def parse_query_with_ollama(query_text):
-    subject_topics = {
-        "Algebra I": [
-            "The Real Number System",
-            "Quantities",
-            "Seeing Structure in Expressions",
-            "Arithmetic with Polynomials and Rational Expressions",
-            "Creating Equations",
-            "Reasoning with Equations and Inequalities",
-            "Solving One Variable Equations",
-            "Systems of Equations",
-            "Interpreting Functions",
-            "Building Functions",
-            "Linear, Quadratic, and Exponential Models",
-            "Interpreting categorical and quantitative data"
-        ],
-        "Algebra II": [
-            "Exponents and Radicals",
-            "Quantities in Modeling",
-            "Complex Numbers",
-            "Seeing Structure in Expressions",
-            "Factoring Polynomials",
-            "Polynomial Identities",
-            "Rational Expressions",
-            "Creating Equations",
-            "Reasoning with Equations and Inequalities",
-            "Solving equations and inequalities in one variable",
-            "Solving systems of equations",
-            "Graphically solving equations and inequalities",
-            "Interpreting Functions",
-            "Building Functions",
-            "Linear, Quadratic, and Exponential Models",
-            "Trigonometric Functions",
-            "Modeling with Trigonometric Functions",
-            "Trigonometric Identities",
-            "Interpreting Categorical and Quantitative Data",
-            "Making Inferences and Justifying Conclusions",
-            "Conditional Probability and the Rules of Probability",
-            "Equations of Parabolas with Focus and Directrix"
+    return {
+        "status": "alive",
+        "parse_cache": parse_cache.stats(),
+        "db": db.stats(),
+        "session_writes": session_store.stats(),
+        "janitor": janitor.stats(),
+        "singleflight": singleflight.stats(),
+        "llm_breaker": llm_breaker.stats(),
+    }, 200
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def llm_request_json(query_text):
+    """Chat-completions request body asking the LLM to parse one query."""
+    return {
+        "model": "accounts/fireworks/models/llama-v3p3-70b-instruct",
+        "messages": [
+            {"role": "user", "content": build_parse_prompt(query_text)}
         ],
-        "Geometry": [
-            'Transformations in the Plane',
-            'Rigid Motions and Triangle Congruence',
-            'Proving Geometric Theorems',
-            'Constructions',
-            'Similarity Transformations',
-            'Proving Theorems Using Similarity',
-            'Right Triangle Trigonometry',
-            'Theorems with Circles',
-            'Arc Lengths and Areas of Circles',
-            'Equations of Circles',
-            'Coordinate Geometry',
-            'Volume',
-            'Cross Sections',
-            'Modeling with Geometry'
-        ]
+        "temperature": 0,
+        "max_tokens": 120,
+        "response_format": {"type": "json_object"}
     }
-    topic_whitelist_md = []
-    for subject, topics in subject_topics.items():
-        topic_whitelist_md.append(f"#### {subject} topics")
-        for t in topics:
-            topic_whitelist_md.append(f"- {t}")
-    topic_whitelist_section = "\n".join(topic_whitelist_md)
-    print(f"[DEBUG] Parsing query with Ollama: {query_text}")
-    prompt = f"""
-        You are a precise JSON-only parser for Regents practice questions. Given a student’s raw request, extract exactly these fields and nothing else in a single-line JSON object:
-
-        • intent: one of "generate", "list_topics", or "count_questions"  
-        • "generate": return actual practice questions  
-        • "list_topics": list all available topics (optionally filtered by subject)  
-        • "count_questions": return the count of questions matching the filters  
-
-        • subject: one of "Algebra I", "Algebra II", "Geometry", or "ELA" (empty if unspecified)  
-        • topic: string; if intent="generate", must be exactly one of the valid topics for the chosen subject (empty otherwise)  
-        • type: one of "MCQ", "CRQ", or "Essay" (treat "SAQ" or "Short Answer" as "CRQ"; empty if unspecified)  
-        • limit: integer number of questions (default to 5 for "generate"; must be 0 for "list_topics" or "count_questions")  
-
-        ### Default rules & error-proofing  
-        - If the text asks to “list topics” or “what topics”, set intent="list_topics" (subject may still be filled).  
-        - If it asks “how many” or “count”, set intent="count_questions" (ignore or zero out limit).  
-        - Otherwise default intent="generate".  
-        - Non-numeric counts (“some”, “a few”) → limit=5.  
-        - Accept spelled-out numbers up to “twenty” (e.g. “ten”→10); else default limit=5.  
-        - Always output valid JSON; do not include any extra text, explanations, or markdown.
-
-        ### Subject → Topic Whitelist  
-        {topic_whitelist_section}
-
-        ### JSON schema (exactly these keys; no extras)
-        {{  
-        "intent":  "<generate|list_topics|count_questions>",  
-        "subject": "<subject or empty string>",  
-        "topic":   "<one valid topic for that subject or empty string>",  
-        "type":    "<MCQ|CRQ|Essay or empty string>",  
-        "limit":   <integer number of questions or 0>  
-        }}
-
-        Student Query: "{query_text}"
-            """.strip()
-    try:
-        response = session.post(
-                FIREWORKS_URL,
-                headers=FIREWORKS_HEADERS,
-                json={
-                    "model": "accounts/fireworks/models/llama-v3p3-70b-instruct",
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0,
-                    "max_tokens": 120,
-                    "response_format": {"type": "json_object"}
-                }
-            )
-        
-        response.raise_for_status()
 
+def parse_llm_reply(reply):
+    """The five parse fields from a chat-completions response body."""
+    raw = reply["choices"][0]["message"]["content"]
+    log.debug("llm raw output=%r", raw)
 
-        raw = response.json()["choices"][0]["message"]["content"]
-        print(f"[DEBUG] Ollama raw output:\n{raw}")
+    parsed = json.loads(raw)
 
-        parsed = json.loads(raw)
+    topic = clean_topic(parsed.get("topic", ""))
+    return (
+        parsed.get("intent",       "generate"),
+        parsed.get("subject",      ""),
+        lookup_topic(topic, parsed.get("subject", "")) or topic,
+        parsed.get("type",         ""),
+        clamp_limit(int(parsed.get("limit",     5)))
+    )
 
-        return (
-            parsed.get("intent",       "generate"),
-            parsed.get("subject",      ""),
-            clean_topic(parsed.get("topic",        "")),
-            parsed.get("type",         ""),
-            int(parsed.get("limit",     5))
-        )
+def parse_query_with_ollama(query_text):
+    """
+    Ask the LLM to parse the query, memoized on its normalized text.
+    Returns (fields, source) where source is "cache", "llm", "coalesced"
+    (shared a concurrent identical request's LLM call), "fallback" (the
+    call failed) or "breaker" (Fireworks is being skipped); the last two
+    carry the local parser's best guess.
+    """
+    cache_key = normalize_query(query_text)
+    cached = parse_cache.get(cache_key)
+    if cached is not None:
+        return cached, "cache"
+
+    # A classroom asking the same thing at once makes one Fireworks call between them
+    (result, source), shared = parse_flights.do(cache_key, _llm_parse, query_text, cache_key)
+    return result, "coalesced" if shared and source == "llm" else source
+
+def _llm_parse(query_text, cache_key):
+    token = llm_breaker.allow()
+    if token is None:
+        return fallback_parse(query_text), "breaker"
+    log.debug("llm parse query=%r", query_text)
+    start = time.perf_counter()
+    reached = False
+    try:
+        with metrics.LLM_PARSE_SECONDS.time():
+            response = _post_llm(llm_request_json(query_text))
+        reached = True
+        result = parse_llm_reply(response.json())
+        parse_cache.put(cache_key, result)
+        return result, "llm"
 
     except Exception as e:
-        print(f"Ollama parsing failed: {e}")
-        # Always return exactly five elements:
-        return ("generate", "", "", "", 5)
+        log.warning("llm parse failed error=%r", e)
+        metrics.PARSE_FAILURES.inc()
+        return fallback_parse(query_text), "fallback"
+    finally:
+        # A reply we can't read still means Fireworks is up; only transport errors, 4xx/5xx and slow calls count
+        llm_breaker.record(token, reached, time.perf_counter() - start)
+
+def _post_llm(body):
+    """
+    POST a parse request, all attempts inside LLM_BUDGET_S of wall-clock
+    time. Connection errors and 502/503/504 are retried while the budget
+    leaves room for a connect; a read timeout is not, it has already used
+    the budget up.
+    """
+    deadline = time.monotonic() + LLM_BUDGET_S
+    retries = LLM_RETRIES
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            response = session.post(
+                FIREWORKS_URL,
+                headers=FIREWORKS_HEADERS,
+                json=body,
+                timeout=(min(LLM_CONNECT_TIMEOUT_S, remaining), min(LLM_READ_TIMEOUT_S, remaining)),
+                stream=True
+            )
+            if response.status_code in LLM_RETRY_STATUSES:
+                response.close()
+                response.raise_for_status()
+        except (requests.ConnectionError, requests.HTTPError) as e:
+            if not retries or deadline - time.monotonic() < LLM_CONNECT_TIMEOUT_S:
+                raise
+            retries -= 1
+            log.info("llm parse retry error=%r", e)
+            continue
+        _read_before(response, deadline)
+        response.raise_for_status()
+        return response
+
+def _read_before(response, deadline):
+    """
+    Read a streamed reply's body by the wall-clock deadline. The read
+    timeout only bounds each recv, so a server trickling bytes could
+    otherwise hold the call open indefinitely; the socket's timeout is cut
+    to what is left of the budget before every read instead.
+    """
+    chunks = []
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                response.close()
+                raise requests.ReadTimeout("llm budget used up reading the reply")
+            conn = response.raw.connection
+            if conn is not None and conn.sock is not None:
+                conn.sock.settimeout(remaining)
+            # read1 returns whatever one recv yields instead of blocking for a full
+            # chunk; decode_content=True on it is urllib3 2.x only (pinned in requirements.txt)
+            chunk = response.raw.read1(64 * 1024, decode_content=True)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except urllib3.exceptions.ReadTimeoutError as e:
+        response.close()
+        raise requests.ReadTimeout(e) from e
+    # requests has no public way to hand it a body read like this; .content, .json()
+    # and .text all read the private _content, which .content itself fills (requests 2.x)
+    response._content = b"".join(chunks)
+
+def fallback_parse(query_text):
+    """What the LLM path answers when Fireworks can't: the local parser's guess at any confidence. Never cached."""
+    return parse_locally(query_text)[0]
+
+def confident_local_parse(query_text):
+    """The local rule-based parser's five fields, or None when it isn't confident enough."""
+    parsed, confidence = parse_locally(query_text)
+    log.debug("local parse confidence=%.2f fields=%s", confidence, parsed)
+    return parsed if confidence >= LOCAL_PARSE_MIN_CONFIDENCE else None
+
+def parse_query(query_text):
+    """
+    Parse with the local rule-based parser and only fall back to the LLM
+    when its confidence is low. Returns the usual five fields plus the
+    name of the path that handled the query ("local", "cache", "llm",
+    "coalesced", "fallback" or "breaker").
+    """
+    parsed = confident_local_parse(query_text)
+    if parsed is not None:
+        source = "local"
+    else:
+        parsed, source = parse_query_with_ollama(query_text)
+    metrics.QUERY_PARSER.inc(source=source)
+    return (*parsed, source)
 
 def clean_topic(raw_topic: str) -> str:
     """
@@ -254,101 +363,28 @@ def clean_topic(raw_topic: str) -> str:
     #         \s*   any number of spaces
     return re.sub(r'^\d+[\.\)\:]\s*', '', raw_topic).strip()
 
-def fetch_questions(subject, topic, qtype, limit):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    print(f"Topic: {topic}")
-    query = "SELECT * FROM questions WHERE 1=1"
-    params = []
-    if subject:
-        query += " AND subject = ?"
-        params.append(subject)
-    if topic:
-        query += " AND topic = ?"
-        params.append(topic)
-    if qtype:
-        query += " AND type = ?"
-        params.append(qtype)
-    query += " ORDER BY RANDOM() LIMIT ?"
-    params.append(limit)
-
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def fetch_questions(subject, topic, qtype, limit, seed=None, session_id=None):
+    """
+    Draw `limit` random questions matching the filters. Pass a seed for a
+    reproducible quiz, or a session_id to skip questions that session has
+    already been given.
+    """
+    conn = get_connection(readonly=True)
+    exclude = set()
+    if session_id:
+        with metrics.SQLITE_QUERY_SECONDS.time(query="session_question_ids"):
+            exclude = {row[0] for row in conn.execute(
+                "SELECT question_id FROM session_questions WHERE session_id = ?", (session_id,)
+            )}
+    # Parses cached before MAX_LIMIT existed may still carry any count
+    ids = sampler.sample(subject, topic, qtype, clamp_limit(limit), seed=seed, exclude=exclude)
+    return catalog.questions(ids)
 
 def list_topics(subject):
-    conn = sqlite3.connect(DB_PATH)
-    cur  = conn.cursor()
-    if subject:
-        cur.execute("SELECT DISTINCT topic FROM questions WHERE subject = ?", (subject,))
-    else:
-        cur.execute("SELECT DISTINCT topic FROM questions")
-    topics = [row[0] for row in cur.fetchall() if row[0]]
-    conn.close()
-    return topics
+    return catalog.list_topics(subject)
 
 def count_questions(subject, topic, qtype):
-    conn = sqlite3.connect(DB_PATH)
-    cur  = conn.cursor()
-    query = "SELECT COUNT(*) FROM questions WHERE 1=1"
-    params = []
-    if subject:
-        query += " AND subject = ?"; params.append(subject)
-    if topic:
-        query += " AND topic = ?"; params.append(topic)
-    if qtype:
-        query += " AND type = ?";  params.append(qtype)
-    cur.execute(query, params)
-    (count,) = cur.fetchone()
-    conn.close()
-    return count
-
-def generate_pdf(questions, filename):
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    answer_key = []
-    for idx, q in enumerate(questions, start=1):
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        # Build header and force it into Latin‑1
-        subject = q.get("subject", "")
-        month   = q.get("month", "")
-        year    = q.get("year", "")
-        header  = f"{subject} - {month} {year}"   # use hyphen instead of em‑dash
-        # Strip out any non‑Latin1 characters silently:
-        header_safe = header.encode('latin1', errors='ignore').decode('latin1')
-        pdf.cell(0, 8, header_safe, ln=True)
-
-        # Insert image…
-        image_path = os.path.join(IMG_DIR.rstrip("images/"), q["question_image_path"])
-        try:
-            if os.path.exists(image_path):
-                page_w = pdf.w - 2 * pdf.l_margin
-                img_w = 180
-                x = pdf.l_margin + (page_w - img_w) / 2
-                y = pdf.get_y() + 5
-                pdf.image(image_path, x=x, y=y, w=img_w)
-                pdf.ln(h=(img_w * 0.75) + 10)
-                answer_key.append(q["correct_answer"])
-            else:
-                pdf.multi_cell(0, 10, f"Image not found: {image_path}")
-        except Exception as e:
-            pdf.multi_cell(0, 10, f"Error loading image: {image_path}\n{e}")
-
-    # Answer key page…
-    if answer_key:
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        pdf.multi_cell(0, 10, "Answer Key:")
-        for i, ans in enumerate(answer_key, start=1):
-            pdf.multi_cell(0, 10, f"Page {i}: {ans}")
-
-    path = os.path.join(OUTPUT_PDF_DIR, filename)
-    pdf.output(path)
-    return path
+    return catalog.count(subject, topic, qtype)
 
 def help_response():
     help_text ="""
@@ -373,7 +409,7 @@ def help_response():
       <li><b>CRQ</b> = Constructed Response Question</li>
     </ul>
     """
-    return jsonify({"response": help_text})
+    return {"response": help_text}
 
 @app.route('/debug/image')
 def debug_image():
@@ -410,45 +446,127 @@ def debug_image():
 
 @app.route('/api/query', methods=['POST'])
 def query():
-    print("inside query endpoint")
     data = request.json
+    error = seed_error(data)
+    if error:
+        return jsonify({"error": error}), 400
     user_query = data.get("query", "").strip()
-    sess_id = data.get("session_id")
-
-    conn = sqlite3.connect(DB_PATH)
-    cur  = conn.cursor()
-    cur.execute("""
-    INSERT INTO sessions(session_id, last_active)
-        VALUES (?, CURRENT_TIMESTAMP)
-    ON CONFLICT(session_id) DO
-        UPDATE SET last_active = CURRENT_TIMESTAMP
-    """, (sess_id,))
-    conn.commit()
+    log.info("query received session=%s text=%r", data.get("session_id"), user_query)
+    parsed = None
+    if not is_help_query(user_query):
+        parsed = parse_query(user_query)
+        g.parsed_by = parsed[-1]
+    pdf_url_for = lambda filename: url_for('download', file=filename, _external=True)
+
+    mode = stream_mode(request.args.get("stream"), request.headers.get("Accept"))
+    if mode:
+        events = query_events(data, parsed, pdf_url_for, request.host_url)
+        return Response(
+            stream_with_context(encode_event(event, body, mode) for event, body in events),
+            mimetype=STREAM_TYPES[mode],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
-    print(f"[INFO] Received query: {user_query}")
+    payload, exchange = answer_query(data, parsed, pdf_url_for)
+    # A single write per request: bump the session, plus the exchange when questions were generated
+    session_store.save(data.get("session_id"), exchange)
+    return jsonify(payload)
+
+def seed_error(data):
+    """Why the request's "seed" can't seed the sampler, or None; only integers and strings can."""
+    seed = data.get("seed")
+    if seed is None or isinstance(seed, (int, str)):
+        return None
+    return '"seed" must be an integer or a string'
+
+def stream_mode(requested, accept):
+    """"ndjson", "sse" or None, from ?stream= first and the Accept header second."""
+    if requested:
+        return requested if requested in STREAM_TYPES else None
+    accept = accept or ""
+    return next((mode for mode, mimetype in STREAM_TYPES.items() if mimetype in accept), None)
+
+def encode_event(event, body, mode):
+    if mode == "sse":
+        return f"event: {event}\ndata: {json.dumps(body)}\n\n"
+    return json.dumps({"event": event, **body}) + "\n"
+
+def query_events(data, parsed, pdf_url_for, image_base_url):
+    """
+    Streaming form of /api/query: yields (event, body) pairs as each part
+    of the answer is ready. "parsed" comes first, then "questions" (with
+    absolute image URLs) as soon as they are fetched, then "pdf" once the
+    render finishes or PDF_WAIT_TIMEOUT_S passes, and always "done" with
+    the usual response text last. Only "parsed" and "done" appear for
+    help, list and count replies; "error" replaces whatever is left if
+    something raises.
+    """
+    if parsed is None:
+        yield "parsed", {"intent": "help"}
+    else:
+        intent, subject, topic, qtype, limit, parsed_by = parsed
+        yield "parsed", {"intent": intent, "subject": subject, "topic": topic,
+                         "type": qtype, "limit": limit, "parser": parsed_by}
+    try:
+        payload, exchange = answer_query(data, parsed, pdf_url_for)
+        questions = payload.get("questions")
+        if questions:
+            yield "questions", {"questions": [
+                dict(q, image_url=image_base_url + q["question_image_path"]) for q in questions
+            ]}
+        # After the questions are out, so the write isn't on the time to first question
+        session_store.save(data.get("session_id"), exchange)
+        if questions:
+            filename = pdf_filename(questions)
+            status = pdf_jobs.status(filename)
+            if status == "pending":
+                status = pdf_jobs.wait(filename, PDF_WAIT_TIMEOUT_S)
+            yield "pdf", {"pdf_url": payload["pdf_url"], "status": status}
+        yield "done", {"response": payload["response"]}
+    except Exception:
+        log.exception("query stream failed")
+        yield "error", {"error": "failed to build the answer"}
+
+def is_help_query(user_query):
+    return not user_query or user_query.lower() in {"help", "how do i ask", "show me examples"}
+
+def answer_query(data, parsed, pdf_url_for):
+    """
+    Build the /api/query payload for `parsed`, the parse_query() result
+    (None for a help request); pdf_url_for(filename) gives the download
+    link. Returns (payload, exchange) where exchange is (student_text,
+    bot_text, questions) for session_store.save, or None when nothing but
+    the session's last_active needs recording. Shared by the Flask route
+    and the ASGI one in asgi.py, so it must not touch the request context.
+    """
+    user_query = data.get("query", "").strip()
+    sess_id = data.get("session_id")
 
     # Help trigger
-    if not user_query or user_query.lower() in {"help", "how do i ask", "show me examples"}:
-        print("[INFO] Help response triggered")
-        return help_response()
+    if parsed is None:
+        metrics.HELP_RESPONSES.inc(reason="asked")
+        return help_response(), None
 
-    intent, subject, topic, qtype, limit = parse_query_with_ollama(user_query)
-    print(f"[DEBUG] Parsed query -> Subject: {subject}, Topic: {clean_topic(topic)}, Type: {qtype}, Limit: {limit}")
+    intent, subject, topic, qtype, limit, parsed_by = parsed
+    log.debug("parsed query source=%s intent=%s subject=%r topic=%r type=%r limit=%s",
+              parsed_by, intent, subject, topic, qtype, limit)
+    # Intents come from the LLM too, so anything unexpected is folded into one label value
+    metrics.QUERY_INTENTS.inc(intent=intent if intent in KNOWN_INTENTS else "other")
 
     # If nothing was parsed, fallback to help
     bot_resp = ""
     if intent == "list_topics":
         if not subject:
-            return jsonify({"response": "No topics found for that subject.<br>Try something like 'List topics for Algebra I'"})
+            return {"response": "No topics found for that subject.<br>Try something like 'List topics for Algebra I'"}, None
         topics = list_topics(subject)
         if topics:
             # Build an HTML bullet list
             title = f"Available topics for <b>{subject}</b>:" if subject else "Available topics:"
             items = "".join(f"<li>{t}</li>" for t in topics)
             bot_resp = f"{title}<ul style='margin-top:0.5rem'>{items}</ul>"
-            return jsonify({"response": bot_resp})
+            return {"response": bot_resp}, None
         else:
-            return jsonify({"response": "No topics found for that subject."})
+            return {"response": "No topics found for that subject."}, None
 
     
     if intent == "count_questions":
@@ -459,63 +577,41 @@ def query():
         if qtype:   parts.append(qtype)
         label = " ".join(parts) or "all questions"
         bot_resp = f"There are {cnt} {label} in the database."
-        return jsonify({"response": bot_resp})
+        return {"response": bot_resp}, None
     
     if not any([subject, topic, qtype]):
-        print("[WARN] Query parsing returned empty fields")
-        return help_response()
-
-    questions = fetch_questions(subject, topic, qtype, limit)
-    print(f"[DEBUG] Retrieved {len(questions)} questions from DB")
+        log.warning("query parse returned empty fields text=%r", user_query)
+        metrics.HELP_RESPONSES.inc(reason="empty_parse")
+        return help_response(), None
+
+    questions = fetch_questions(
+        subject, topic, qtype, limit,
+        seed=data.get("seed"),
+        session_id=sess_id if data.get("no_repeats") else None
+    )
+    log.debug("fetched questions count=%d", len(questions))
 
     if not questions:
-        print("[WARN] No questions found for given criteria.")
-        return jsonify({"response": "No questions found for your query. Try being more specific, like '5 Algebra I MCQs on exponents'."})
-    cur.execute("""
-      INSERT INTO session_messages(session_id, sender, text)
-      VALUES (?, 'student', ?)
-    """, (sess_id, user_query))
-    conn.commit()
-
-    unique_filename = f"questions_{uuid.uuid4().hex}.pdf"
-    pdf_path = generate_pdf(questions, unique_filename)
-    print(f"[INFO] PDF generated at {pdf_path}")
-    
-    download_url = url_for('download', file=unique_filename, _external=True)
-    print(f"[INFO] Download URL: {download_url}")
+        log.info("no questions found subject=%r topic=%r type=%r", subject, topic, qtype)
+        return {"response": "No questions found for your query. Try being more specific, like '5 Algebra I MCQs on exponents'."}, None
+
+    # Rendered in the background; the download link waits for it if needed
+    filename = pdf_jobs.submit(questions)
+
+    download_url = pdf_url_for(filename)
+    log.debug("pdf download url=%s", download_url)
 
     summary = f"Here are {len(questions)} {qtype or ''} questions on '{topic or subject}':"
     pdf_link = f"<a href='{download_url}' target='_blank'>📄 Click here to view/download the PDF</a>"
     bot_resp = f"{summary}<br><br>{pdf_link}"
 
-    cur.execute("""
-      INSERT INTO session_messages(session_id, sender, text)
-      VALUES (?, 'bot', ?)
-    """, (sess_id, bot_resp))
-    conn.commit()
-
-    bot_msg_id = cur.lastrowid
-    print(f"Message_ID: {bot_msg_id}")
-    print(questions)
-    for i, q in enumerate(questions):
-        cur.execute("""
-        INSERT INTO session_questions
-            (session_id, message_idx, question_idx, question_id, question_data)
-        VALUES (?, ?, ?, ?, ?)
-        """, (
-        sess_id,
-        bot_msg_id,
-        i,
-        q["id"],
-        json.dumps(q, ensure_ascii=False)
-        ))
-        conn.commit()
-    conn.close()
-    return jsonify({
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("returning question ids=%s", [q["id"] for q in questions])
+    return {
       "response": summary + "<br><br>" + pdf_link,
       "pdf_url": download_url,
       "questions": questions    # 👈 send back the raw question objects
-    })
+    }, (user_query, bot_resp, questions)
 
 # @app.route('/images/<path:filename>')
 # def serve_image(filename):
@@ -525,10 +621,22 @@ IMG_DIR = os.path.join(app.static_folder, 'images')
 
 @app.route('/images/<path:filename>')
 def serve_images(filename):
+    start = time.perf_counter()
     abs_path = os.path.join(IMG_DIR, filename)
     if not os.path.exists(abs_path):
         abort(404)
-    return send_from_directory(IMG_DIR, filename)
+    # ?w=<px> plus the Accept header pick a pre-built WebP/PNG derivative when one exists
+    variant = image_variants.negotiate(
+        filename, request.headers.get("Accept"), request.args.get("w", type=int)
+    )
+    if variant:
+        response = send_file(variant, max_age=86400)
+    else:
+        response = send_from_directory(IMG_DIR, filename)
+    response.vary.add("Accept")
+    # The body streams after this returns, so this is lookup and open time only
+    metrics.IMAGE_SERVE_SECONDS.observe(time.perf_counter() - start, source="variant" if variant else "original")
+    return response
 
 @app.route('/api/download', methods=['GET'])
 def download():
@@ -542,7 +650,12 @@ def download():
         return jsonify({"error": "invalid filename"}), 400
 
     abs_path = os.path.join(OUTPUT_PDF_DIR, safe_name)
-    if not os.path.exists(abs_path):
+    status = pdf_jobs.status(safe_name)
+    if status == "pending":
+        status = pdf_jobs.wait(safe_name, PDF_WAIT_TIMEOUT_S)
+        if status == "pending":
+            return jsonify({"status": "pending"}), 202, {"Retry-After": "2"}
+    if status != "ready":
         return jsonify({"error": "file not found"}), 404
 
     # Let it open inline in the browser; set a download name
@@ -556,50 +669,69 @@ def download():
 
 @app.route('/api/history/<session_id>')
 def history(session_id):
+    """
+    A page of the session's messages, oldest first. With no ?limit and no
+    cursor it is the whole history, as older clients expect; otherwise
+    the newest page, ?before=<id> pages back through older messages and
+    ?since=<id> fetches what was added after a message the client already
+    has. ?limit sets the page size. The response is still the
+    plain JSON array; cursors travel in X-History-Before (older messages
+    remain) and X-History-Since (newest id the client now has), with
+    X-History-More set when a ?since page stopped short of the newest.
+    Passing both cursors is a 400.
+    """
+    limit = request.args.get("limit", type=int)
+    before = request.args.get("before", type=int)
+    since = request.args.get("since", type=int)
+    if limit is not None or before is not None or since is not None:
+        limit = min(max(HISTORY_PAGE_SIZE if limit is None else limit, 1), HISTORY_MAX_PAGE_SIZE)
+    if before is not None and since is not None:
+        # They page in opposite directions; one request can only follow one of them
+        return jsonify({"error": "pass either ?before or ?since, not both"}), 400
+
+    conn = get_connection(readonly=True)
+    # The newest message id changes with every write to the session and the catalogue version
+    # with every question edit, so together they validate any page without reading it
+    with metrics.SQLITE_QUERY_SECONDS.time(query="history_latest"):
+        latest = session_store.latest_message_id(conn, session_id)
+    cursor = f"b{before}" if before is not None else f"s{since}" if since is not None else ""
+    etag = f"{latest}.{catalog.current().version}.{cursor}.{limit or 'all'}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    with metrics.SQLITE_QUERY_SECONDS.time(query="history_page"):
+        messages, has_more = session_store.history_page(conn, session_id, limit, before=before, since=since)
+    rows = [
+        {"id": m["id"], "sender": m["sender"], "text": m["text"],
+         "questions": catalog.questions(m["question_ids"])}
+        for m in messages
+    ]
+
+    response = jsonify(rows)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    if since is None and has_more:
+        response.headers["X-History-Before"] = str(rows[0]["id"])
+    if before is None:
+        response.headers["X-History-Since"] = str(rows[-1]["id"] if rows else since or 0)
+        if since is not None and has_more:
+            response.headers["X-History-More"] = "1"
+    return response
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute("""
-      SELECT
-        sm.id        AS id,
-        sm.sender    AS sender,
-        sm.text      AS text,
-        GROUP_CONCAT(sq.question_data, '||') AS questions_concat
-      FROM session_messages sm
-      LEFT JOIN session_questions sq
-        ON sm.session_id = sq.session_id
-       AND sm.id         = sq.message_idx
-      WHERE sm.session_id = ?
-      GROUP BY sm.id
-      ORDER BY sm.created_at
-    """, (session_id,))
-
-    rows = []
-    for r in cur.fetchall():
-        row = dict(r)
-        qc = row.pop('questions_concat')
-        row['questions'] = qc.split('||') if qc else []
-        # parse each JSON string back into dict
-        row['questions'] = [json.loads(q) for q in row['questions']]
-        rows.append(row)
-
-    conn.close()
-    return jsonify(rows)
 @app.route('/api/end_session', methods=['POST'])
 def end_session():
     sess_id = request.json.get("session_id")
     if not sess_id:
         return jsonify({"error": "session_id required"}), 400
 
-    conn = sqlite3.connect(DB_PATH)
-    cur  = conn.cursor()
-    cur.execute("DELETE FROM session_messages WHERE session_id = ?", (sess_id,))
-    cur.execute("DELETE FROM sessions         WHERE session_id = ?", (sess_id,))
-    cur.execute("DELETE FROM session_questions WHERE session_id = ?", (sess_id,))  
-    conn.commit()
-    conn.close()
+    with metrics.SQLITE_QUERY_SECONDS.time(query="end_session"), transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM session_messages WHERE session_id = ?", (sess_id,))
+        cur.execute("DELETE FROM sessions         WHERE session_id = ?", (sess_id,))
+        cur.execute("DELETE FROM session_questions WHERE session_id = ?", (sess_id,))
     return jsonify({"status": "ok"})
 
 @app.route("/", defaults={"path": ""})
@@ -611,8 +743,6 @@ def serve_vue(path):
         return send_from_directory("dist", "index.html")
 
 if __name__ == '__main__':
-    print("[INFO] Initializing database...")
-    init_db()
-    print("[INFO] Starting Flask server on http://localhost:8080")
+    log.info("starting Flask server on http://localhost:8080")
     port = int(os.getenv("PORT", 8080))
     app.run(host="0.0.0.0", port=port)
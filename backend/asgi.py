@@ -0,0 +1,225 @@
+# ASGI entry point: /api/query runs on an event loop with an async, pooled Fireworks client so one
+# process can keep hundreds of LLM parses in flight; every other route is the Flask app, run on a
+# thread pool. SQLite lookups, session writes and PDF submission stay on worker threads.
+#   uvicorn asgi:app --host 0.0.0.0 --port 8080 --proxy-headers --forwarded-allow-ips '*'
+#   gunicorn asgi:app -k uvicorn_worker.UvicornWorker -w 1 -b [::]:8080
+import asyncio
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+import anyio
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, request_response
+
+import app as backend
+import janitor
+import metrics
+import session_store
+from singleflight import AsyncSingleFlight
+from query_cache import normalize_query
+
+log = logging.getLogger("asgi")
+
+# Parses allowed in flight at once; the rest wait on the semaphore rather than piling onto Fireworks
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+# Threads for the blocking part of /api/query (catalogue, SQLite, PDF submit, session write)
+DB_THREADS = int(os.getenv("ASGI_DB_THREADS", "8"))
+# Threads the Flask routes run on
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "8"))
+
+_llm_client = None
+_llm_slots = None
+_db_limiter = None
+_llm_in_flight = 0
+# Reported under the same "parse" group as the Flask path's coalescing
+_parse_flights = AsyncSingleFlight("parse")
+
+metrics.Gauge("regents_llm_in_flight", "Async Fireworks parse calls currently in flight",
+              collect=lambda: _llm_in_flight)
+metrics.Gauge("regents_asgi_db_threads_busy", "Executor threads running /api/query work",
+              collect=lambda: _db_limiter.borrowed_tokens if _db_limiter else 0)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    global _llm_client, _llm_slots, _db_limiter
+    _llm_client = httpx.AsyncClient(
+        headers=backend.FIREWORKS_HEADERS,
+        timeout=httpx.Timeout(backend.LLM_READ_TIMEOUT_S, connect=backend.LLM_CONNECT_TIMEOUT_S),
+        limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=64),
+    )
+    _llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    _db_limiter = anyio.CapacityLimiter(DB_THREADS)
+    try:
+        yield
+    finally:
+        await _llm_client.aclose()
+
+
+async def _blocking(fn, *args):
+    return await anyio.to_thread.run_sync(fn, *args, limiter=_db_limiter)
+
+
+async def parse_query_with_ollama_async(query_text):
+    """Async twin of app.parse_query_with_ollama; same cache, prompt, fallback and coalescing."""
+    cache = backend.parse_cache
+    cache_key = normalize_query(query_text)
+    # The shared cache tier is a SQLite file, so only touch it off the event loop
+    cached = await _blocking(cache.get, cache_key) if cache.db_path else cache.get(cache_key)
+    if cached is not None:
+        return cached, "cache"
+    (result, source), shared = await _parse_flights.do(cache_key, _llm_parse, query_text, cache_key)
+    return result, "coalesced" if shared and source == "llm" else source
+
+
+async def _llm_parse(query_text, cache_key):
+    global _llm_in_flight
+    cache = backend.parse_cache
+    breaker = backend.llm_breaker
+    # The budget covers the wait for a slot as well as the attempts, but only the attempts count
+    # towards the breaker: a queue here is this process overloaded, not Fireworks failing
+    deadline = asyncio.get_running_loop().time() + backend.LLM_BUDGET_S
+    try:
+        async with asyncio.timeout_at(deadline):
+            await _llm_slots.acquire()
+    except TimeoutError:
+        log.warning("llm parse got no slot within budget in_flight=%d", _llm_in_flight)
+        metrics.PARSE_FAILURES.inc()
+        return backend.fallback_parse(query_text), "fallback"
+    try:
+        token = breaker.allow()
+        if token is None:
+            return backend.fallback_parse(query_text), "breaker"
+        log.debug("llm parse query=%r", query_text)
+        start = time.perf_counter()
+        reached = False
+        _llm_in_flight += 1
+        try:
+            async with asyncio.timeout_at(deadline):
+                with metrics.LLM_PARSE_SECONDS.time():
+                    response = await _post_llm(backend.llm_request_json(query_text))
+            reached = True
+        except Exception as e:
+            log.warning("llm parse failed error=%r", e)
+            metrics.PARSE_FAILURES.inc()
+            return backend.fallback_parse(query_text), "fallback"
+        finally:
+            _llm_in_flight -= 1
+            breaker.record(token, reached, time.perf_counter() - start)
+    finally:
+        _llm_slots.release()
+
+    try:
+        result = backend.parse_llm_reply(response.json())
+        if cache.db_path:
+            await _blocking(cache.put, cache_key, result)
+        else:
+            cache.put(cache_key, result)
+        return result, "llm"
+    except Exception as e:
+        log.warning("llm parse failed error=%r", e)
+        metrics.PARSE_FAILURES.inc()
+        return backend.fallback_parse(query_text), "fallback"
+
+
+async def _post_llm(body):
+    # Same retry rule as app._post_llm; the caller's timeout enforces the budget
+    retries = backend.LLM_RETRIES
+    while True:
+        try:
+            response = await _llm_client.post(backend.FIREWORKS_URL, json=body)
+            if response.status_code in backend.LLM_RETRY_STATUSES:
+                response.raise_for_status()
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if not retries or isinstance(e, httpx.ReadTimeout):
+                raise
+            retries -= 1
+            log.info("llm parse retry error=%r", e)
+            continue
+        response.raise_for_status()
+        return response
+
+
+async def parse_query_async(query_text):
+    parsed = backend.confident_local_parse(query_text)
+    if parsed is not None:
+        source = "local"
+    else:
+        parsed, source = await parse_query_with_ollama_async(query_text)
+    metrics.QUERY_PARSER.inc(source=source)
+    return (*parsed, source)
+
+
+async def query(request):
+    start = time.perf_counter()
+    janitor.ensure_started(backend.OUTPUT_PDF_DIR)
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "request body must be JSON"}, status_code=400)
+    error = backend.seed_error(data)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+
+    user_query = data.get("query", "").strip()
+    log.info("query received session=%s text=%r", data.get("session_id"), user_query)
+    parsed = None
+    if not backend.is_help_query(user_query):
+        parsed = await parse_query_async(user_query)
+
+    # /api/download is served by the Flask app mounted below
+    download_base = f"{request.base_url}api/download?"
+    pdf_url_for = lambda filename: download_base + urlencode({"file": filename})
+    headers = {"X-Query-Parser": parsed[-1]} if parsed else {}
+
+    def answer_and_save():
+        payload, exchange = backend.answer_query(data, parsed, pdf_url_for)
+        session_store.save(data.get("session_id"), exchange)
+        return payload
+
+    mode = backend.stream_mode(request.query_params.get("stream"), request.headers.get("accept"))
+    if mode:
+        # A sync iterator, so Starlette steps it on its thread pool; the PDF wait blocks a thread, not the loop
+        events = backend.query_events(data, parsed, pdf_url_for, str(request.base_url))
+        response = StreamingResponse(
+            (backend.encode_event(event, body, mode) for event, body in events),
+            media_type=backend.STREAM_TYPES[mode],
+            headers={**headers, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    else:
+        response = JSONResponse(await _blocking(answer_and_save), headers=headers)
+    # As in the Flask hook, a stream is timed up to the point it starts
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                         endpoint="query", method="POST", status=200)
+    return response
+
+
+def _cors(asgi_app):
+    # Same policy as flask_cors in app.py; "*" in an origin there is a subdomain wildcard
+    wildcards = [o for o in backend.CORS_ORIGINS if "*" in o]
+    return CORSMiddleware(
+        asgi_app,
+        allow_origins=[o for o in backend.CORS_ORIGINS if "*" not in o],
+        allow_origin_regex="|".join(re.escape(o).replace(r"\*", r"[\w-]+") for o in wildcards) or None,
+        allow_credentials=True,
+        allow_methods=["POST"],
+        allow_headers=["Content-Type"],
+        expose_headers=backend.CORS_EXPOSE_HEADERS,
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/api/query", _cors(request_response(query)), methods=["POST", "OPTIONS"]),
+        Mount("/", app=WSGIMiddleware(backend.app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
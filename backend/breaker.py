@@ -0,0 +1,94 @@
+# Circuit breaker for an upstream dependency (the Fireworks parser). Enough consecutive failures
+# or slow calls open it and callers skip the upstream entirely; after a cooldown one probe call is
+# let through (half-open) and its outcome either closes the breaker or restarts the cooldown.
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, cooldown_s=30.0, slow_call_s=None):
+        """
+        `slow_call_s`, if set, makes a call that succeeded but took longer
+        than that count as a failure, so a brownout trips the breaker as
+        surely as an outage.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.slow_call_s = slow_call_s
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        # Bumped on every state change; a call's token says which state let it through
+        self._epoch = 1
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a call may go upstream now: a token to hand back to
+        record(), or None. While half-open only one probe is out at a
+        time; everyone else is turned away until it reports.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown_s:
+                self._set(HALF_OPEN)
+            if self.state == CLOSED:
+                return self._epoch
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return self._epoch
+            self.rejected += 1
+            return None
+
+    def record(self, token, ok, elapsed):
+        """
+        Report the outcome of a call allow() let through. Calls let through
+        before the last state change (ones that started before the breaker
+        opened and end after it) are ignored, so only the probe's outcome
+        settles a half-open breaker.
+        """
+        ok = ok and (self.slow_call_s is None or elapsed <= self.slow_call_s)
+        with self._lock:
+            if token != self._epoch:
+                return
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._set(CLOSED if ok else OPEN)
+            elif ok:
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failure_threshold:
+                    self._set(OPEN)
+
+    def stats(self):
+        with self._lock:
+            retry_in = self.cooldown_s - (time.monotonic() - self._opened_at) if self.state == OPEN else 0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "opens": self.opens,
+                "rejected": self.rejected,
+                "retry_in_s": round(max(retry_in, 0), 1),
+            }
+
+    def _set(self, state):
+        # Called with the lock held
+        self._epoch += 1
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.opens += 1
+            log.warning("circuit open name=%s consecutive_failures=%d cooldown_s=%s",
+                        self.name, self.consecutive_failures, self.cooldown_s)
+        elif state == CLOSED:
+            self.consecutive_failures = 0
+            log.info("circuit closed name=%s", self.name)
+        self.state = state
@@ -0,0 +1,102 @@
+# In-memory snapshot of the question bank: question rows, topic lists, count cube and id lists
+import logging
+import threading
+import time
+from array import array
+from types import MappingProxyType
+
+import db
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the questions table at one question_bank_version.
+    Filter keys are (subject, topic, type) tuples with "" meaning "any".
+    """
+    __slots__ = ("version", "rows", "topics", "ids", "counts")
+
+    def __init__(self, version, rows, topics, ids):
+        self.version = version
+        self.rows = MappingProxyType(rows)
+        self.topics = MappingProxyType(topics)
+        self.ids = MappingProxyType(ids)
+        self.counts = MappingProxyType({key: len(v) for key, v in ids.items()})
+
+
+def load_snapshot(conn):
+    version = db.question_bank_version(conn)
+    rows = {}
+    topics = {}
+    ids = {}
+    cur = conn.execute("SELECT * FROM questions ORDER BY id")
+    columns = [c[0] for c in cur.description]
+    for values in cur:
+        row = dict(zip(columns, values))
+        qid, subject, topic, qtype = row["id"], row["subject"], row["topic"], row["type"]
+        rows[qid] = row
+        if topic:
+            topics.setdefault(subject, set()).add(topic)
+            topics.setdefault("", set()).add(topic)
+        for s in (subject, ""):
+            for t in (topic, ""):
+                for q in (qtype, ""):
+                    ids.setdefault((s, t, q), array("q")).append(qid)
+    return CatalogSnapshot(
+        version,
+        rows,
+        {subject: tuple(sorted(names)) for subject, names in topics.items()},
+        ids
+    )
+
+
+class Catalog:
+    """
+    Holds the current CatalogSnapshot and swaps in a new one when the
+    database's question_bank_version moves (checked at most every
+    refresh_interval seconds). Readers never see a half-built snapshot.
+    """
+
+    def __init__(self, refresh_interval=5.0):
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        with metrics.SQLITE_QUERY_SECONDS.time(query="catalog_load"):
+            self._snapshot = load_snapshot(conn)
+        self._checked_at = time.monotonic()
+        log.info("question catalogue loaded version=%s questions=%d",
+                 self._snapshot.version, self._snapshot.counts.get(("", "", ""), 0))
+
+    def current(self):
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < self.refresh_interval:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is None or now - self._checked_at >= self.refresh_interval:
+                conn = db.get_connection(readonly=True)
+                if self._snapshot is None or db.question_bank_version(conn) != self._snapshot.version:
+                    self.load(conn)
+                self._checked_at = now
+        return self._snapshot
+
+    def list_topics(self, subject):
+        return list(self.current().topics.get(subject or "", ()))
+
+    def count(self, subject, topic, qtype):
+        return self.current().counts.get((subject or "", topic or "", qtype or ""), 0)
+
+    def ids(self, subject, topic, qtype):
+        return self.current().ids.get((subject or "", topic or "", qtype or ""), ())
+
+    def questions(self, ids):
+        """
+        Question rows for `ids`, in that order, as fresh dicts. Ids no
+        longer in the question bank are skipped.
+        """
+        rows = self.current().rows
+        return [dict(rows[qid]) for qid in ids if qid in rows]
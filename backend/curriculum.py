@@ -0,0 +1,240 @@
+# Subject/topic catalogue shared by the backend and the ingestion scripts (built once at import)
+import re
+
+SUBJECT_TOPICS = {
+    "Algebra I": [
+        "The Real Number System",
+        "Quantities",
+        "Seeing Structure in Expressions",
+        "Arithmetic with Polynomials and Rational Expressions",
+        "Creating Equations",
+        "Reasoning with Equations and Inequalities",
+        "Solving One Variable Equations",
+        "Systems of Equations",
+        "Interpreting Functions",
+        "Building Functions",
+        "Linear, Quadratic, and Exponential Models",
+        "Interpreting Categorical and Quantitative Data"
+    ],
+    "Algebra II": [
+        "Exponents and Radicals",
+        "Quantities in Modeling",
+        "Complex Numbers",
+        "Seeing Structure in Expressions",
+        "Factoring Polynomials",
+        "Polynomial Identities",
+        "Rational Expressions",
+        "Creating Equations",
+        "Reasoning with Equations and Inequalities",
+        "Solving equations and inequalities in one variable",
+        "Solving systems of equations",
+        "Graphically solving equations and inequalities",
+        "Interpreting Functions",
+        "Building Functions",
+        "Linear, Quadratic, and Exponential Models",
+        "Trigonometric Functions",
+        "Modeling with Trigonometric Functions",
+        "Trigonometric Identities",
+        "Interpreting Categorical and Quantitative Data",
+        "Making Inferences and Justifying Conclusions",
+        "Conditional Probability and the Rules of Probability",
+        "Equations of Parabolas with Focus and Directrix"
+    ],
+    "Geometry": [
+        'Transformations in the Plane',
+        'Rigid Motions and Triangle Congruence',
+        'Proving Geometric Theorems',
+        'Constructions',
+        'Similarity Transformations',
+        'Proving Theorems Using Similarity',
+        'Right Triangle Trigonometry',
+        'Theorems with Circles',
+        'Arc Lengths and Areas of Circles',
+        'Equations of Circles',
+        'Coordinate Geometry',
+        'Volume',
+        'Cross Sections',
+        'Modeling with Geometry'
+    ]
+}
+SUBJECTS = tuple(SUBJECT_TOPICS)
+
+# Learning-standard cluster code -> topic, as printed in each exam's rating guide
+CLUSTER_MAPS = {
+    "Algebra I": {
+        "N-RN.B": "The Real Number System",
+        "N-Q.A": "Quantities",
+        "N-QA": "Quantities",
+        "A-SSE.A": "Seeing Structure in Expressions",
+        "A-SSE.B": "Seeing Structure in Expressions",
+        "A-APR.A": "Arithmetic with Polynomials and Rational Expressions",
+        "A-APR.B": "Arithmetic with Polynomials and Rational Expressions",
+        "A-CED.A": "Creating Equations",
+        "A-REI.A": "Reasoning with Equations and Inequalities",
+        "A-REI.B": "Solving One Variable Equations",
+        "A-REI.C": "Systems of Equations",
+        "A-REI.D": "Reasoning with Equations and Inequalities",
+        "F-IF.A": "Interpreting Functions",
+        "F-IF.B": "Interpreting Functions",
+        "F-IF.C": "Interpreting Functions",
+        "F-BF.A": "Building Functions",
+        "F-BF.B": "Building Functions",
+        "F-LE.A": "Linear, Quadratic, and Exponential Models",
+        "F-LE.B": "Linear, Quadratic, and Exponential Models",
+        "S-ID.A": "Interpreting Categorical and Quantitative Data",
+        "S-ID.B": "Interpreting Categorical and Quantitative Data",
+        "S-ID.C": "Interpreting Categorical and Quantitative Data"
+    },
+    "Algebra II": {
+        "N-RN.A": "Exponents and Radicals",
+        "N-CN.A": "Complex Numbers",
+
+        # Seeing Structure in Expressions
+        "A-SSE.A": "Seeing Structure in Expressions",
+        "A-SSE.B": "Seeing Structure in Expressions",
+
+        # Arithmetic with Polynomials & Rational Expressions
+        "A-APR.B": "Factoring Polynomials",
+        "A-APR.D": "Rational Expressions",
+
+        # Creating Equations
+        "A-CED.A": "Creating Equations",
+
+        # Reasoning with Equations & Inequalities
+        "A-REI.A": "Reasoning with Equations and Inequalities",
+        "A-REI.B": "Solving equations and inequalities in one variable",
+        "A-REI.C": "Solving systems of equations",
+        "A-REI.D": "Graphically solving equations and inequalities",
+
+        # Interpreting Functions
+        "F-IF.A": "Interpreting Functions",
+        "F-IF.B": "Interpreting Functions",
+        "F-IF.C": "Interpreting Functions",
+
+        # Building Functions
+        "F-BF.A": "Building Functions",
+        "F-BF.B": "Building Functions",
+
+        # Linear, Quadratic, and Exponential Models
+        "F-LE.A": "Linear, Quadratic, and Exponential Models",
+        "F-LE.B": "Linear, Quadratic, and Exponential Models",
+
+        # Trigonometric Functions
+        "F-TF.A": "Trigonometric Functions",
+        "F-TF.B": "Modeling with Trigonometric Functions",
+        "F-TF.C": "Trigonometric Identities",
+
+        # Statistics & Probability
+        "S-ID.A": "Interpreting Categorical and Quantitative Data",
+        "S-ID.B": "Interpreting Categorical and Quantitative Data",
+        "S-IC.A": "Making Inferences and Justifying Conclusions",
+        "S-IC.B": "Making Inferences and Justifying Conclusions",
+        "S-CP.A": "Conditional Probability and the Rules of Probability",
+        "S-CP.B": "Conditional Probability and the Rules of Probability",
+    },
+    "Geometry": {
+        # Congruence
+        "G-CO.A": "Transformations in the Plane",
+        "G-CO.B": "Rigid Motions and Triangle Congruence",
+        "G-CO.C": "Proving Geometric Theorems",
+        "G-CO.D": "Constructions",
+
+        # Similarity, Right Triangles & Trigonometry
+        "G-SRT.A": "Similarity Transformations",
+        "G-SRT.B": "Proving Theorems Using Similarity",
+        "G-SRT.C": "Right Triangle Trigonometry",
+
+        # Circles
+        "G-C.A": "Theorems with Circles",
+        "G-C.B": "Arc Lengths and Areas of Circles",
+
+        # Expressing Geometric Properties with Equations
+        "G-GPE.A": "Equations of Circles",
+        "G-GPE.B": "Coordinate Geometry",
+
+        # Geometric Measurement & Dimension
+        "G-GMD.A": "Volume",
+        "G-GMD.B": "Cross Sections",
+
+        # Modeling with Geometry
+        "G-MG.A": "Modeling with Geometry",
+    }
+}
+
+# Topics written by the ingestion scripts must be ones the parser can hand back
+for _subject, _clusters in CLUSTER_MAPS.items():
+    _unknown = set(_clusters.values()) - set(SUBJECT_TOPICS[_subject])
+    assert not _unknown, f"{_subject} cluster map has topics missing from the whitelist: {_unknown}"
+
+
+def normalize_topic_name(name):
+    """Lowercase, drop punctuation and collapse whitespace so near-miss spellings compare equal."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name.lower()).split())
+
+
+# normalized topic name -> {subject: canonical topic}
+TOPIC_LOOKUP = {}
+for _subject, _topics in SUBJECT_TOPICS.items():
+    for _topic in _topics:
+        TOPIC_LOOKUP.setdefault(normalize_topic_name(_topic), {})[_subject] = _topic
+
+
+def lookup_topic(name, subject=""):
+    """
+    Return the whitelisted spelling of a topic name, or "" if it isn't one.
+    When the subject is given the topic must belong to it.
+    """
+    matches = TOPIC_LOOKUP.get(normalize_topic_name(name))
+    if not matches:
+        return ""
+    if subject:
+        return matches.get(subject, "")
+    return next(iter(matches.values()))
+
+
+_whitelist_md = []
+for _subject, _topics in SUBJECT_TOPICS.items():
+    _whitelist_md.append(f"#### {_subject} topics")
+    for _topic in _topics:
+        _whitelist_md.append(f"- {_topic}")
+TOPIC_WHITELIST_MD = "\n".join(_whitelist_md)
+
+# Everything in the LLM parse prompt except the student's query
+PARSE_PROMPT_PREFIX = ("""
+        You are a precise JSON-only parser for Regents practice questions. Given a student’s raw request, extract exactly these fields and nothing else in a single-line JSON object:
+
+        • intent: one of "generate", "list_topics", or "count_questions"  
+        • "generate": return actual practice questions  
+        • "list_topics": list all available topics (optionally filtered by subject)  
+        • "count_questions": return the count of questions matching the filters  
+
+        • subject: one of "Algebra I", "Algebra II", "Geometry", or "ELA" (empty if unspecified)  
+        • topic: string; if intent="generate", must be exactly one of the valid topics for the chosen subject (empty otherwise)  
+        • type: one of "MCQ", "CRQ", or "Essay" (treat "SAQ" or "Short Answer" as "CRQ"; empty if unspecified)  
+        • limit: integer number of questions (default to 5 for "generate"; must be 0 for "list_topics" or "count_questions")  
+
+        ### Default rules & error-proofing  
+        - If the text asks to “list topics” or “what topics”, set intent="list_topics" (subject may still be filled).  
+        - If it asks “how many” or “count”, set intent="count_questions" (ignore or zero out limit).  
+        - Otherwise default intent="generate".  
+        - Non-numeric counts (“some”, “a few”) → limit=5.  
+        - Accept spelled-out numbers up to “twenty” (e.g. “ten”→10); else default limit=5.  
+        - Always output valid JSON; do not include any extra text, explanations, or markdown.
+
+        ### Subject → Topic Whitelist  
+        """ + TOPIC_WHITELIST_MD + """
+
+        ### JSON schema (exactly these keys; no extras)
+        {  
+        "intent":  "<generate|list_topics|count_questions>",  
+        "subject": "<subject or empty string>",  
+        "topic":   "<one valid topic for that subject or empty string>",  
+        "type":    "<MCQ|CRQ|Essay or empty string>",  
+        "limit":   <integer number of questions or 0>  
+        }
+
+""").lstrip()
+
+
+def build_parse_prompt(query_text):
+    return f'{PARSE_PROMPT_PREFIX}        Student Query: "{query_text}"'
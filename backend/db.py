@@ -0,0 +1,98 @@
+# SQLite connection management for the Flask backend (per-thread handles with tuned PRAGMAs)
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # /regents-quiz/backend
+DB_PATH = os.path.abspath(os.getenv("REGENTS_DB_PATH") or os.path.join(BASE_DIR, "regentsqs.db"))
+
+BUSY_TIMEOUT_S = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_KIB", "16384"))
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_BYTES", str(128 * 1024 * 1024)))
+# Taking the write lock slower than this counts as a busy-wait in stats()
+BUSY_WAIT_THRESHOLD_S = 0.005
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {
+    "opened": 0,
+    "reused": 0,
+    "busy_waits": 0,
+    "busy_wait_seconds": 0.0,
+}
+
+
+def _bump(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _open(readonly):
+    if readonly:
+        # The question bank is never written by the web app
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_S)
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_S)
+        # Stored in the database file; a no-op once the file is already in WAL mode
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.row_factory = sqlite3.Row
+    # Off by default in SQLite; needed for the session tables' ON DELETE CASCADE
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    _bump("opened")
+    return conn
+
+
+def get_connection(readonly=False):
+    """
+    Return this thread's connection, opening it on first use. Handles
+    are never shared across threads or forked workers.
+    """
+    key = "ro" if readonly else "rw"
+    pid, conn = getattr(_local, key, (None, None))
+    if conn is not None and pid == os.getpid():
+        _bump("reused")
+        return conn
+    conn = _open(readonly)
+    setattr(_local, key, (os.getpid(), conn))
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Run the block as one write transaction on this thread's connection."""
+    conn = get_connection()
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    waited = time.perf_counter() - start
+    if waited > BUSY_WAIT_THRESHOLD_S:
+        _bump("busy_waits")
+        _bump("busy_wait_seconds", waited)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def release():
+    """Roll back anything a request left open so the next one starts clean."""
+    pid, conn = getattr(_local, "rw", (None, None))
+    if conn is not None and pid == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def question_bank_version(conn):
+    """Counter bumped by triggers on every insert, update or delete in questions."""
+    return conn.execute("SELECT version FROM question_bank_version").fetchone()[0]
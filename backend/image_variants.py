@@ -0,0 +1,70 @@
+# Naming and content negotiation for pre-built question image derivatives
+# (built offline by scripts/build_image_variants.py)
+import os
+
+from werkzeug.security import safe_join
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # /regents-quiz/backend
+IMAGES_DIR = os.path.join(BASE_DIR, "static", "images")
+VARIANTS_DIR = os.path.join(BASE_DIR, "static", "variants")
+
+# Target display widths in pixels; the originals are ~1500px wide 300-DPI crops
+VARIANT_WIDTHS = (480, 800, 1200)
+VARIANT_FORMATS = ("webp", "png")
+
+
+def variant_name(width, fmt):
+    return f"w{width}.{fmt}"
+
+
+# generate_pdf embeds the widest palette PNG; it already fills a 180mm-wide slot at ~170 DPI
+PDF_VARIANT = variant_name(VARIANT_WIDTHS[-1], "png")
+
+
+def all_variant_names():
+    return [variant_name(w, f) for w in VARIANT_WIDTHS for f in VARIANT_FORMATS]
+
+
+def variant_path(image_rel, variant):
+    """
+    Absolute path of a derivative of images/<image_rel>, e.g.
+    mcqQuestionBlock/q.png -> static/variants/mcqQuestionBlock/q_w480.webp.
+    Returns None for paths that would escape the variants directory.
+    """
+    stem, _ = os.path.splitext(image_rel)
+    return safe_join(VARIANTS_DIR, f"{stem}_{variant}")
+
+
+def image_rel_path(question_image_path):
+    """questions.question_image_path ("images/...") relative to IMAGES_DIR."""
+    prefix = "images/"
+    if question_image_path.startswith(prefix):
+        return question_image_path[len(prefix):]
+    return question_image_path
+
+
+def negotiate(image_rel, accept, width=None):
+    """
+    Pick the derivative to serve for a request: WebP when the client
+    accepts it, otherwise PNG, at the narrowest width that still covers
+    `width` (the widest one when no width is asked for). Returns None
+    when no derivative has been built, so the caller serves the original.
+    """
+    fmt = "webp" if "image/webp" in (accept or "") else "png"
+    if width:
+        candidates = [w for w in VARIANT_WIDTHS if w >= width] or [VARIANT_WIDTHS[-1]]
+        chosen = candidates[0]
+    else:
+        chosen = VARIANT_WIDTHS[-1]
+    path = variant_path(image_rel, variant_name(chosen, fmt))
+    if path and os.path.exists(path):
+        return path
+    return None
+
+
+def pdf_image_path(question_image_path):
+    """The PDF-ready derivative if it has been built, else the original."""
+    path = variant_path(image_rel_path(question_image_path), PDF_VARIANT)
+    if path and os.path.exists(path):
+        return path
+    return os.path.join(IMAGES_DIR, image_rel_path(question_image_path))
@@ -0,0 +1,252 @@
+# Background janitor: expires stale sessions and generated PDFs and hands free pages back to the
+# filesystem. Runs on a thread inside each gunicorn worker (only one sweeps at a time) or as a
+# sidecar:  python janitor.py [--once]   (set REGENTS_DB_PATH to point it at another database)
+import argparse
+import fcntl
+import logging
+import os
+import threading
+import time
+
+import db
+from pdf_builder import PENDING_MAX_AGE_S
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # /regents-quiz/backend
+# Same default as app.OUTPUT_PDF_DIR, so the sidecar sweeps the directory the workers write to
+OUTPUT_PDF_DIR = os.path.abspath(os.getenv("OUTPUT_PDF_DIR") or os.path.join(BASE_DIR, "output_pdf"))
+
+# Seconds between sweeps; 0 turns the in-process janitor off (e.g. when running the sidecar)
+INTERVAL_S = float(os.getenv("JANITOR_INTERVAL_S", "600"))
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+# A PDF's mtime is refreshed whenever its link is handed out again, so this counts from last use
+PDF_TTL_HOURS = float(os.getenv("PDF_TTL_HOURS", "24"))
+PDF_DISK_BUDGET_MB = float(os.getenv("PDF_DISK_BUDGET_MB", "500"))
+# Rows per delete transaction, and a pause between them so request writers get the lock
+BATCH_SIZE = int(os.getenv("JANITOR_BATCH", "200"))
+CHUNK_PAUSE_S = 0.01
+# Free pages returned to the filesystem per sweep
+VACUUM_PAGES = int(os.getenv("JANITOR_VACUUM_PAGES", "2000"))
+# Held while sweeping; its mtime records when the last sweep by any process finished
+LOCK_PATH = db.DB_PATH + ".janitor-lock"
+
+_last_sweep = {}
+_thread = None
+_pid = None
+_start_lock = threading.Lock()
+
+
+def _in_chunks(delete_chunk):
+    """Call delete_chunk() until it deletes nothing; returns the summed counts."""
+    totals = None
+    while True:
+        counts = delete_chunk()
+        if not any(counts):
+            return totals or counts
+        totals = counts if totals is None else tuple(a + b for a, b in zip(totals, counts))
+        time.sleep(CHUNK_PAUSE_S)
+
+
+def _delete_messages(conn, message_ids):
+    marks = ",".join("?" * len(message_ids))
+    questions = conn.execute(
+        f"DELETE FROM session_questions WHERE message_idx IN ({marks})", message_ids).rowcount
+    messages = conn.execute(
+        f"DELETE FROM session_messages WHERE id IN ({marks})", message_ids).rowcount
+    return messages, questions
+
+
+def _stale_sessions_chunk():
+    # Children first so the counts are exact even though the foreign keys would cascade
+    with db.transaction() as conn:
+        session_ids = [r[0] for r in conn.execute("""
+            SELECT session_id FROM sessions
+             WHERE last_active < datetime('now', ?)
+             LIMIT ?
+        """, (f"-{SESSION_TTL_HOURS} hours", BATCH_SIZE))]
+        if not session_ids:
+            return 0, 0, 0
+        marks = ",".join("?" * len(session_ids))
+        questions = conn.execute(
+            f"DELETE FROM session_questions WHERE session_id IN ({marks})", session_ids).rowcount
+        messages = conn.execute(
+            f"DELETE FROM session_messages WHERE session_id IN ({marks})", session_ids).rowcount
+        sessions = conn.execute(
+            f"DELETE FROM sessions WHERE session_id IN ({marks})", session_ids).rowcount
+    return sessions, messages, questions
+
+
+def _orphan_messages_chunk():
+    # Left behind by the old cleanup script, which ran without foreign keys
+    with db.transaction() as conn:
+        message_ids = [r[0] for r in conn.execute("""
+            SELECT id FROM session_messages m
+             WHERE NOT EXISTS (SELECT 1 FROM sessions s WHERE s.session_id = m.session_id)
+             LIMIT ?
+        """, (BATCH_SIZE,))]
+        if not message_ids:
+            return 0, 0
+        return _delete_messages(conn, message_ids)
+
+
+def _orphan_questions_chunk():
+    with db.transaction() as conn:
+        keys = conn.execute("""
+            SELECT DISTINCT session_id, message_idx FROM session_questions q
+             WHERE NOT EXISTS (SELECT 1 FROM session_messages m WHERE m.id = q.message_idx)
+             LIMIT ?
+        """, (BATCH_SIZE,)).fetchall()
+        if not keys:
+            return (0,)
+        return (conn.executemany(
+            "DELETE FROM session_questions WHERE session_id = ? AND message_idx = ?", keys
+        ).rowcount,)
+
+
+def sweep_sessions():
+    sessions, messages, questions = _in_chunks(_stale_sessions_chunk)
+    orphan_messages, orphan_message_questions = _in_chunks(_orphan_messages_chunk)
+    (orphan_questions,) = _in_chunks(_orphan_questions_chunk)
+    return {
+        "sessions": sessions,
+        "messages": messages + orphan_messages,
+        "questions": questions + orphan_message_questions + orphan_questions,
+        "orphans": orphan_messages + orphan_message_questions + orphan_questions,
+    }
+
+
+def sweep_pdfs(pdf_dir=OUTPUT_PDF_DIR):
+    """Delete expired PDFs and dead render leftovers, then the oldest PDFs until under budget."""
+    now = time.time()
+    removed = freed = 0
+    kept = []
+    try:
+        entries = list(os.scandir(pdf_dir))
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        age = now - st.st_mtime
+        if entry.name.endswith((".tmp", ".pending")):
+            expired = age > PENDING_MAX_AGE_S
+        elif entry.name.endswith(".pdf"):
+            expired = age > PDF_TTL_HOURS * 3600
+            if not expired:
+                kept.append((st.st_mtime, entry.path, st.st_size))
+        else:
+            continue
+        if expired and _remove(entry.path):
+            removed += 1
+            freed += st.st_size
+
+    total = sum(size for _, _, size in kept)
+    budget = PDF_DISK_BUDGET_MB * 1024 * 1024
+    for _, path, size in sorted(kept):
+        if total <= budget:
+            break
+        if _remove(path):
+            removed += 1
+            freed += size
+            total -= size
+    return {"pdfs": removed, "pdf_bytes": freed, "pdf_bytes_kept": total}
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def vacuum(conn):
+    """
+    Return up to VACUUM_PAGES free pages to the filesystem; returns the
+    bytes reclaimed. Needs the incremental auto_vacuum mode migration 6
+    switches the database to.
+    """
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+    # execute() steps this pragma only once, freeing a single page; executescript runs it to completion
+    conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+    # In WAL mode the file only shrinks once the truncation is checkpointed
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+    return (pages_before - pages_after) * page_size
+
+
+def sweep(pdf_dir=OUTPUT_PDF_DIR):
+    start = time.perf_counter()
+    counts = sweep_sessions()
+    counts.update(sweep_pdfs(pdf_dir))
+    counts["vacuum_bytes"] = vacuum(db.get_connection())
+    counts["seconds"] = round(time.perf_counter() - start, 3)
+    counts["finished_at"] = time.time()
+    _last_sweep.clear()
+    _last_sweep.update(counts)
+    log.info("sweep removed sessions=%d messages=%d questions=%d orphans=%d pdfs=%d pdf_bytes=%d "
+             "vacuum_bytes=%d seconds=%.2f", counts["sessions"], counts["messages"], counts["questions"],
+             counts["orphans"], counts["pdfs"], counts["pdf_bytes"], counts["vacuum_bytes"], counts["seconds"])
+    return counts
+
+
+def sweep_if_due(pdf_dir=OUTPUT_PDF_DIR, interval=INTERVAL_S):
+    """
+    Sweep unless another process is sweeping or one finished less than
+    half an interval ago. Returns the counts, or None if it skipped.
+    """
+    created = not os.path.exists(LOCK_PATH)
+    with open(LOCK_PATH, "a") as lock:
+        if created:
+            os.utime(LOCK_PATH, (0, 0))
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        if time.time() - os.path.getmtime(LOCK_PATH) < interval / 2:
+            return None
+        counts = sweep(pdf_dir)
+        os.utime(LOCK_PATH)
+        return counts
+
+
+def _run(pdf_dir, interval):
+    while True:
+        try:
+            sweep_if_due(pdf_dir, interval)
+        except Exception:
+            log.exception("sweep failed")
+        time.sleep(interval)
+
+
+def ensure_started(pdf_dir=OUTPUT_PDF_DIR):
+    """Start this process's janitor thread if it isn't running (threads don't survive a fork)."""
+    global _thread, _pid
+    if INTERVAL_S <= 0 or _pid == os.getpid():
+        return
+    with _start_lock:
+        if _pid != os.getpid():
+            _thread = threading.Thread(target=_run, args=(pdf_dir, INTERVAL_S), name="janitor", daemon=True)
+            _pid = os.getpid()
+            _thread.start()
+
+
+def stats():
+    return dict(_last_sweep)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expire stale sessions and PDFs, reclaim free pages")
+    parser.add_argument("--once", action="store_true", help="sweep once and exit")
+    parser.add_argument("--interval", type=float, default=INTERVAL_S or 600)
+    parser.add_argument("--pdf-dir", default=OUTPUT_PDF_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(name)s: %(message)s")
+    if args.once:
+        sweep(args.pdf_dir)
+    else:
+        _run(args.pdf_dir, args.interval)
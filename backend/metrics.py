@@ -0,0 +1,150 @@
+# Prometheus text-format metrics without a client library: counters, gauges and histograms kept
+# per process and rendered by /metrics. With several gunicorn workers each reports its own.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; wide enough for sub-millisecond SQLite reads and multi-second LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, doc, labels=(), collect=None):
+        """
+        `collect`, if given, is called at scrape time and returns either a
+        number or a dict of {label values tuple: number}; use it to expose
+        stats another object already keeps.
+        """
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _current(self):
+        if self.collect is None:
+            with _lock:
+                values = dict(self._values)
+            # An unlabeled series reads 0 before its first increment rather than being absent
+            return values or ({(): 0} if not self.labelnames else {})
+        value = self.collect()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._current().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (last one is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = _labels(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in list(_registry):
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "regents_http_request_seconds", "Time to build a response, by endpoint and status",
+    labels=("endpoint", "method", "status"))
+LLM_PARSE_SECONDS = Histogram(
+    "regents_llm_parse_seconds", "Fireworks round trip for one query parse")
+SQLITE_QUERY_SECONDS = Histogram(
+    "regents_sqlite_query_seconds", "SQLite statements and transactions, by query", labels=("query",))
+PDF_RENDER_SECONDS = Histogram(
+    "regents_pdf_render_seconds", "Time to render one question PDF")
+IMAGE_SERVE_SECONDS = Histogram(
+    "regents_image_serve_seconds", "Time to pick and open a question image", labels=("source",))
+
+QUERY_INTENTS = Counter(
+    "regents_query_intents_total", "Parsed /api/query intents", labels=("intent",))
+QUERY_PARSER = Counter(
+    "regents_query_parser_total", "Which parser handled an /api/query request", labels=("source",))
+HELP_RESPONSES = Counter(
+    "regents_help_responses_total", "Queries answered with the help text", labels=("reason",))
+PARSE_FAILURES = Counter(
+    "regents_parse_failures_total", "LLM parse calls that failed and fell back to the local parser")
+PDF_FAILURES = Counter(
+    "regents_pdf_failures_total", "PDF renders that raised")
@@ -0,0 +1,225 @@
+# Versioned schema migrations for regentsqs.db (version is kept in PRAGMA user_version)
+import logging
+import sqlite3
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    (1, "base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            month TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            question_image_path TEXT NOT NULL,
+            correct_answer TEXT,
+            explanation TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id   TEXT PRIMARY KEY,
+            started_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_active  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS session_messages (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id   TEXT    NOT NULL,
+            sender       TEXT    NOT NULL,
+            text         TEXT    NOT NULL,
+            created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(session_id) REFERENCES sessions(session_id)
+                ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS session_questions (
+            session_id    TEXT    NOT NULL,
+            message_idx   INTEGER NOT NULL,
+            question_idx  INTEGER NOT NULL,
+            question_id   INTEGER NOT NULL,
+            question_data TEXT    NOT NULL,
+            PRIMARY KEY (session_id, message_idx, question_idx),
+            FOREIGN KEY (session_id, message_idx)
+                REFERENCES session_messages(session_id, id)
+                ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (2, "covering indexes for hot queries", [
+        "CREATE INDEX IF NOT EXISTS idx_questions_subject_topic_type ON questions(subject, topic, type)",
+        "CREATE INDEX IF NOT EXISTS idx_questions_topic_type ON questions(topic, type)",
+        "CREATE INDEX IF NOT EXISTS idx_session_messages_session ON session_messages(session_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_questions_session_question ON session_questions(session_id, question_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions(last_active)",
+        "ANALYZE",
+    ]),
+    (3, "question bank version counter", [
+        """
+        CREATE TABLE IF NOT EXISTS question_bank_version (
+            id      INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO question_bank_version(id, version) VALUES (1, 0)",
+        """
+        CREATE TRIGGER IF NOT EXISTS questions_bump_version_insert AFTER INSERT ON questions
+        BEGIN UPDATE question_bank_version SET version = version + 1; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS questions_bump_version_update AFTER UPDATE ON questions
+        BEGIN UPDATE question_bank_version SET version = version + 1; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS questions_bump_version_delete AFTER DELETE ON questions
+        BEGIN UPDATE question_bank_version SET version = version + 1; END
+        """,
+    ]),
+    (4, "question image dimensions and derivatives", [
+        "ALTER TABLE questions ADD COLUMN image_width INTEGER",
+        "ALTER TABLE questions ADD COLUMN image_height INTEGER",
+        """
+        CREATE TABLE IF NOT EXISTS question_image_variants (
+            question_id INTEGER NOT NULL,
+            variant     TEXT    NOT NULL,
+            path        TEXT    NOT NULL,
+            width       INTEGER NOT NULL,
+            height      INTEGER NOT NULL,
+            bytes       INTEGER NOT NULL,
+            PRIMARY KEY (question_id, variant),
+            FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    # Questions are hydrated from the in-memory catalogue, so only the ids are kept. The old
+    # foreign key pointed at session_messages(session_id, id), which isn't a unique key.
+    # Rows whose message is already gone are orphans and are not carried over.
+    (5, "session_questions stores question ids only", [
+        """
+        CREATE TABLE session_questions_v5 (
+            session_id    TEXT    NOT NULL,
+            message_idx   INTEGER NOT NULL,
+            question_idx  INTEGER NOT NULL,
+            question_id   INTEGER NOT NULL,
+            PRIMARY KEY (session_id, message_idx, question_idx),
+            FOREIGN KEY (message_idx) REFERENCES session_messages(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO session_questions_v5 (session_id, message_idx, question_idx, question_id)
+        SELECT session_id, message_idx, question_idx, question_id FROM session_questions
+         WHERE message_idx IN (SELECT id FROM session_messages)
+        """,
+        "DROP TABLE session_questions",
+        "ALTER TABLE session_questions_v5 RENAME TO session_questions",
+        "CREATE INDEX idx_session_questions_session_question ON session_questions(session_id, question_id)",
+    ]),
+    # An existing database only switches auto_vacuum mode with a full VACUUM; done once here so the
+    # janitor's sweeps only ever run the cheap incremental_vacuum
+    (6, "incremental auto-vacuum", [
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "VACUUM",
+    ]),
+]
+# VACUUM can't run inside a transaction, so these are applied without one. Each must be safe to
+# repeat: two workers starting together may both run it.
+OUTSIDE_TRANSACTION = {6}
+
+# (description, SQL, params, index the plan must mention)
+PLAN_CHECKS = [
+    ("fetch_questions by subject/topic/type",
+     "SELECT id FROM questions WHERE subject = ? AND topic = ? AND type = ?",
+     ("Algebra I", "Volume", "MCQ"), "idx_questions_subject_topic_type"),
+    ("count_questions by topic/type",
+     "SELECT COUNT(*) FROM questions WHERE topic = ? AND type = ?",
+     ("Volume", "MCQ"), "idx_questions_topic_type"),
+    ("list_topics by subject",
+     "SELECT DISTINCT topic FROM questions WHERE subject = ?",
+     ("Geometry",), "idx_questions_subject_topic_type"),
+    ("history page of a session's messages",
+     "SELECT id, sender, text FROM session_messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+     ("s", 100, 50), "idx_session_messages_session"),
+    ("history etag: newest message of a session",
+     "SELECT MAX(id) FROM session_messages WHERE session_id = ?",
+     ("s",), "idx_session_messages_session"),
+    ("questions already given to a session",
+     "SELECT question_id FROM session_questions WHERE session_id = ?",
+     ("s",), "idx_session_questions_session_question"),
+    ("history questions for a session",
+     "SELECT message_idx, question_id FROM session_questions "
+     "WHERE session_id = ? AND message_idx BETWEEN ? AND ? ORDER BY message_idx, question_idx",
+     ("s", 1, 100), "PRIMARY KEY"),
+    ("stale session cleanup",
+     "SELECT session_id FROM sessions WHERE last_active < ?",
+     ("2000-01-01",), "idx_sessions_last_active"),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Apply every migration newer than the database's user_version, each in
+    its own transaction. Safe to run from several workers at once.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, name, statements in MIGRATIONS:
+            if schema_version(conn) >= version:
+                continue
+            if version in OUTSIDE_TRANSACTION:
+                start = time.perf_counter()
+                for sql in statements:
+                    conn.execute(sql)
+                conn.execute(f"PRAGMA user_version = {version}")
+                log.info("applied migration %d: %s seconds=%.2f", version, name, time.perf_counter() - start)
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another worker may have got here first
+                if schema_version(conn) >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                for sql in statements:
+                    conn.execute(sql)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            log.info("applied migration %d: %s", version, name)
+    finally:
+        conn.isolation_level = isolation_level
+    return schema_version(conn)
+
+
+def assert_query_plans(conn):
+    """Raise AssertionError if any hot query would not use its index."""
+    failures = []
+    for description, sql, params, index in PLAN_CHECKS:
+        plan = " | ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+        if index not in plan:
+            failures.append(f"{description}: expected {index}, got {plan}")
+    assert not failures, "\n".join(failures)
+
+
+if __name__ == "__main__":
+    # python migrations.py [path/to/regentsqs.db] — migrate, then verify the query plans
+    from db import DB_PATH
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    log.info("schema version %d", migrate(conn))
+    assert_query_plans(conn)
+    log.info("all hot queries use their indexes")
+    conn.close()
@@ -0,0 +1,279 @@
+# PDF rendering for generated question sets: a background pool with output cached by question ids
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fpdf import FPDF
+
+import metrics
+from image_variants import pdf_image_path
+from singleflight import SingleFlight
+
+log = logging.getLogger(__name__)
+
+# A .pending marker older than this belongs to a render that died with its worker
+PENDING_MAX_AGE_S = 300
+
+# Part of every PDF's name: bump it when a change here alters what a given question set renders to
+PDF_LAYOUT_VERSION = 2
+# What generate_pdf draws for each question; a change to any of them makes a different PDF
+RENDERED_FIELDS = ("id", "subject", "month", "year", "question_image_path", "correct_answer",
+                   "image_width", "image_height")
+
+# Layout in mm on an A4 page
+IMG_MAX_W = 180
+HEADER_H = 8
+BLOCK_GAP = 6
+PAGE_BOTTOM_MARGIN = 15
+
+
+def _png_size(path):
+    """Pixel size from a PNG's IHDR chunk, without decoding the image."""
+    with open(path, "rb") as f:
+        head = f.read(24)
+    if head[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _header(q):
+    # Build header and force it into Latin‑1
+    subject = q.get("subject", "")
+    month   = q.get("month", "")
+    year    = q.get("year", "")
+    header  = f"{subject} - {month} {year}"   # use hyphen instead of em‑dash
+    # Strip out any non‑Latin1 characters silently:
+    return header.encode('latin1', errors='ignore').decode('latin1')
+
+
+def layout_pages(questions, usable_h):
+    """
+    Pack question blocks onto pages first-fit by height. Each block is
+    (question, image_path, img_w, img_h, block_h) in mm; img_w is None when
+    the image is missing. Returns a list of pages, each a list of blocks.
+    """
+    pages = []  # [remaining_h, blocks]
+    for q in questions:
+        image_path = pdf_image_path(q["question_image_path"])
+        img_w = img_h = None
+        if os.path.exists(image_path):
+            size = (q.get("image_width"), q.get("image_height"))
+            if not all(size):
+                size = _png_size(image_path) or (4, 3)
+            img_w = IMG_MAX_W
+            img_h = img_w * size[1] / size[0]
+            if img_h > usable_h - HEADER_H - BLOCK_GAP:
+                # Tall CRQ crops are scaled down to fit on one page
+                img_h = usable_h - HEADER_H - BLOCK_GAP
+                img_w = img_h * size[0] / size[1]
+            block_h = HEADER_H + img_h + BLOCK_GAP
+        else:
+            block_h = HEADER_H + 10 + BLOCK_GAP
+        block = (q, image_path, img_w, img_h, block_h)
+        for page in pages:
+            if page[0] >= block_h:
+                page[0] -= block_h
+                page[1].append(block)
+                break
+        else:
+            pages.append([usable_h - block_h, [block]])
+    return [blocks for _, blocks in pages]
+
+
+def generate_pdf(questions, path):
+    pdf = FPDF()
+    # Blocks are placed explicitly, so FPDF must not break pages on its own
+    pdf.set_auto_page_break(auto=False)
+    usable_h = pdf.h - pdf.t_margin - PAGE_BOTTOM_MARGIN
+    page_w = pdf.w - 2 * pdf.l_margin
+    answer_key = []
+    for blocks in layout_pages(questions, usable_h):
+        pdf.add_page()
+        pdf.set_font("Arial", size=12)
+        y = pdf.t_margin
+        for q, image_path, img_w, img_h, block_h in blocks:
+            pdf.set_xy(pdf.l_margin, y)
+            if img_w is None:
+                pdf.cell(0, HEADER_H, _header(q), ln=True)
+                pdf.multi_cell(0, 10, f"Image not found: {image_path}")
+                y += block_h
+                continue
+            # Questions are numbered in layout order so the answer key matches the pages
+            number = len(answer_key) + 1
+            pdf.cell(0, HEADER_H, f"{number}. {_header(q)}", ln=True)
+            try:
+                x = pdf.l_margin + (page_w - img_w) / 2
+                pdf.image(image_path, x=x, y=y + HEADER_H, w=img_w, h=img_h)
+                answer_key.append(q["correct_answer"])
+            except Exception as e:
+                pdf.multi_cell(0, 10, f"Error loading image: {image_path}\n{e}")
+            y += block_h
+
+    # Answer key page…
+    if answer_key:
+        pdf.set_auto_page_break(auto=True, margin=PAGE_BOTTOM_MARGIN)
+        pdf.add_page()
+        pdf.set_font("Arial", size=12)
+        pdf.multi_cell(0, 10, "Answer Key:")
+        for i, ans in enumerate(answer_key, start=1):
+            pdf.multi_cell(0, 10, f"Question {i}: {ans}")
+
+    pdf.output(path)
+    return path
+
+
+def pdf_filename(questions):
+    """
+    Name a PDF after what it renders: the ordered questions' drawn fields
+    and PDF_LAYOUT_VERSION. Identical sets share one file, while an edited
+    question or a layout change gets a new one instead of the stale PDF.
+    """
+    content = [PDF_LAYOUT_VERSION] + [[q.get(field) for field in RENDERED_FIELDS] for q in questions]
+    key = json.dumps(content, default=str)
+    return f"questions_{hashlib.sha256(key.encode()).hexdigest()[:32]}.pdf"
+
+
+class PdfJobs:
+    """
+    Renders PDFs on a small thread pool, one render per filename across
+    all gunicorn workers. Within a worker, requests for a set already
+    rendering join it through SingleFlight. Between workers, the render
+    goes to whichever claims the ".pending" marker next to the output
+    first (an O_EXCL create); the rest watch that marker until it's done.
+    """
+
+    def __init__(self, output_dir, max_workers=2):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf")
+        self._renders = SingleFlight("pdf")
+        self._lock = threading.Lock()
+
+    def path(self, filename):
+        return os.path.join(self.output_dir, filename)
+
+    def submit(self, questions):
+        """Queue a render unless the file exists or is already being built; returns the filename."""
+        filename = pdf_filename(questions)
+        with self._lock:
+            if filename not in self._renders:
+                try:
+                    # Refresh the mtime so the janitor's PDF TTL counts from the last time it was handed out
+                    os.utime(self.path(filename))
+                    return filename
+                except FileNotFoundError:
+                    pass
+                token = self._claim(filename)
+                if token is None:
+                    # Another worker is rendering it; status() and wait() follow its .pending marker
+                    return filename
+            else:
+                token = None  # joining this worker's render; see _render for when it is used
+            # Joins the render already queued for this set if there is one
+            self._renders.submit(filename, self._pool, self._render, questions, filename, token)
+        return filename
+
+    def _claim(self, filename):
+        """
+        Create the .pending marker with O_EXCL, so of all the workers
+        asking for a file exactly one renders it. Returns the marker's
+        contents (the owner's token), or None when another worker holds it
+        or the file appeared meanwhile.
+        """
+        pending = self.path(filename) + ".pending"
+        token = f"{os.getpid()}.{uuid.uuid4().hex}"
+        for _ in range(2):
+            try:
+                fd = os.open(pending, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pass
+            else:
+                with os.fdopen(fd, "w") as f:
+                    f.write(token)
+                return token
+            try:
+                if time.time() - os.path.getmtime(pending) < PENDING_MAX_AGE_S:
+                    return None
+                # Left by a worker that died mid-render. Renaming it away succeeds for one taker
+                # only; everyone then races on the O_EXCL create again.
+                stale = f"{pending}.{token}.tmp"
+                os.rename(pending, stale)
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+            if os.path.exists(self.path(filename)):
+                return None
+        return None
+
+    def _release(self, filename, token):
+        # Only the owner removes the marker, and not one a later claimant took over from it
+        pending = self.path(filename) + ".pending"
+        try:
+            with open(pending) as f:
+                if f.read() == token:
+                    os.remove(pending)
+        except FileNotFoundError:
+            pass
+
+    def _render(self, questions, filename, token):
+        path = self.path(filename)
+        if token is None:
+            # A join that landed just after this worker's render finished starts a call of its own
+            if os.path.exists(path):
+                return path
+            token = self._claim(filename)
+            if token is None:
+                return path
+        # Unique per render, so even a stale-marker takeover never shares a temporary file
+        tmp = f"{path}.{token}.tmp"
+        start = time.perf_counter()
+        try:
+            # Render under a temporary name so readers never see a partial file
+            generate_pdf(questions, tmp)
+            os.replace(tmp, path)
+            elapsed = time.perf_counter() - start
+            metrics.PDF_RENDER_SECONDS.observe(elapsed)
+            log.info("pdf generated file=%s questions=%d seconds=%.2f", filename, len(questions), elapsed)
+        except Exception as e:
+            metrics.PDF_FAILURES.inc()
+            log.error("pdf generation failed file=%s error=%r", filename, e)
+            raise
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self._release(filename, token)
+        return path
+
+    def in_flight(self):
+        return self._renders.in_flight()
+
+    def status(self, filename):
+        """"ready", "pending" or "missing"."""
+        if os.path.exists(self.path(filename)):
+            return "ready"
+        if filename in self._renders:
+            return "pending"
+        try:
+            age = time.time() - os.path.getmtime(self.path(filename) + ".pending")
+        except OSError:
+            return "missing"
+        return "pending" if age < PENDING_MAX_AGE_S else "missing"
+
+    def wait(self, filename, timeout):
+        """Block until the PDF is no longer pending or the timeout passes; returns the status."""
+        deadline = time.monotonic() + timeout
+        try:
+            # Counted as a waiter on this worker's render, if it is the one doing it
+            self._renders.wait(filename, timeout)
+        except Exception:
+            pass
+        # Rendered by another worker: all we can do is watch the filesystem
+        while self.status(filename) == "pending" and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return self.status(filename)
@@ -0,0 +1,121 @@
+# Memoization for parsed student queries (in-process LRU + optional SQLite tier shared by workers)
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from query_parser import NUMBER_WORDS
+
+log = logging.getLogger(__name__)
+
+_NUMBER_WORD_RE = re.compile(r"\b(" + "|".join(NUMBER_WORDS) + r")\b")
+
+
+def normalize_query(query_text):
+    """
+    Canonical cache key for a query: case-folded, punctuation stripped,
+    whitespace collapsed and spelled-out numbers turned into digits, so
+    "Five Algebra I MCQs!" and "5 algebra i mcqs" share an entry.
+    """
+    text = query_text.casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = _NUMBER_WORD_RE.sub(lambda m: str(NUMBER_WORDS[m.group(1)]), text)
+    return " ".join(text.split())
+
+
+class QueryCache:
+    def __init__(self, maxsize=1024, ttl=3600, db_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        if db_path:
+            conn = sqlite3.connect(db_path)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS parse_cache (
+                key        TEXT PRIMARY KEY,
+                value      TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+            conn.commit()
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+        value, expires_at = self._get_shared(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += 1
+            self._store(key, value, expires_at)
+        return value
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self.db_path:
+            conn = sqlite3.connect(self.db_path, timeout=1)
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO parse_cache(key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                conn.execute("DELETE FROM parse_cache WHERE expires_at < ?", (time.time(),))
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                # The shared tier is best effort; a locked file only costs a miss later
+                log.warning("shared parse cache write failed error=%r", e)
+            finally:
+                conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+            }
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, key, now):
+        if not self.db_path:
+            return None, 0
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM parse_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            conn.close()
+        if not row:
+            return None, 0
+        return tuple(json.loads(row[0])), row[1]
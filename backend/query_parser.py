@@ -0,0 +1,169 @@
+# Local rule-based parser for /api/query (the LLM is only asked when this one is unsure)
+import re
+
+from curriculum import SUBJECT_TOPICS
+
+NUMBER_WORDS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20,
+}
+DEFAULT_LIMIT = 5
+# Most questions one request can ask for; larger counts are cut down to it
+MAX_LIMIT = 25
+
+# Checked in order, so "Algebra II" has to come before "Algebra I".
+SUBJECT_PATTERNS = [
+    ("Algebra II", r"\b(?:algebra|alg)\s*(?:ii|2|two)\b"),
+    ("Algebra I", r"\b(?:algebra|alg)\s*(?:i|1|one)\b"),
+    ("Geometry", r"\bgeometry\b|\bgeo\b"),
+    ("ELA", r"\bela\b|\benglish\b"),
+]
+TYPE_PATTERNS = [
+    ("MCQ", r"\bmcqs?\b|\bmultiple[\s-]*choice\b"),
+    ("CRQ", r"\bcrqs?\b|\bsaqs?\b|\bshort[\s-]*answers?\b|\bconstructed[\s-]*responses?\b|\bopen[\s-]*ended\b"),
+    ("Essay", r"\bessays?\b"),
+]
+LIST_PATTERN = r"\b(?:list|what|which|show|available)\b.*\btopics?\b|\btopics?\b.*\b(?:list|available)\b"
+COUNT_PATTERN = r"\bhow\s+many\b|\bcount\b|\bnumber\s+of\b"
+VAGUE_LIMIT_PATTERN = r"\b(?:some|a\s+few|several|a\s+couple(?:\s+of)?|couple)\b"
+
+# Words that carry no topic information in a request.
+FILLER_WORDS = {
+    "a", "about", "all", "an", "and", "any", "are", "available", "can", "could",
+    "count", "create", "do", "exam", "few", "for", "from", "generate", "get",
+    "give", "have", "how", "i", "in", "is", "like", "list", "make", "many",
+    "me", "need", "number", "of", "on", "please", "practice", "problem",
+    "problems", "question", "questions", "quiz", "regents", "send", "several",
+    "show", "some", "test", "the", "there", "to", "topic", "topics", "want",
+    "we", "what", "which", "with", "would", "you", "couple", "covering",
+    "involving", "regarding", "related", "it",
+}
+# Words ignored on both sides when comparing against topic names.
+TOPIC_STOPWORDS = {"a", "and", "for", "in", "of", "on", "the", "to", "with", "using"}
+
+
+def _stem(word):
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def topic_tokens(text):
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return [_stem(w) for w in words if w not in TOPIC_STOPWORDS]
+
+
+_TOPIC_INDEX = [
+    (subject, topic, frozenset(topic_tokens(topic)))
+    for subject, topics in SUBJECT_TOPICS.items()
+    for topic in topics
+]
+
+
+def _match_topic(phrase_tokens, subject):
+    """
+    Return (topic, ambiguous) for the whitelisted topic that covers every
+    token of the phrase, preferring the tightest fit. Ambiguous whenever
+    more than one topic covers the phrase, unless it names one of them in
+    full ("similarity" alone could be several Geometry topics).
+    """
+    phrase = set(phrase_tokens)
+    if not phrase:
+        return "", False
+    best, best_score, matches = "", 0.0, set()
+    for subj, topic, tokens in _TOPIC_INDEX:
+        if subject and subj != subject:
+            continue
+        if not phrase <= tokens:
+            continue
+        if tokens == phrase:
+            return topic, False
+        # Lowercased so the same topic listed under two subjects counts once
+        matches.add(topic.lower())
+        score = len(phrase) / len(tokens)
+        if score > best_score:
+            best, best_score = topic, score
+    return best, len(matches) > 1
+
+
+def clamp_limit(limit):
+    return min(max(limit, 0), MAX_LIMIT)
+
+
+def _extract_limit(text):
+    match = re.search(r"\b(\d{1,3})\b", text)
+    if match:
+        return clamp_limit(int(match.group(1))), True
+    for word in re.findall(r"[a-z]+", text):
+        if word in NUMBER_WORDS:
+            return NUMBER_WORDS[word], True
+    return DEFAULT_LIMIT, bool(re.search(VAGUE_LIMIT_PATTERN, text))
+
+
+def parse_locally(query_text):
+    """
+    Parse a student request without calling the LLM.
+
+    Returns ((intent, subject, topic, type, limit), confidence) where
+    confidence is between 0 and 1; callers should defer to the LLM when
+    it is low.
+    """
+    text = query_text.lower()
+    confidence = 1.0
+
+    subject = ""
+    for name, pattern in SUBJECT_PATTERNS:
+        if re.search(pattern, text):
+            subject = name
+            text = re.sub(pattern, " ", text)
+            break
+    if not subject and re.search(r"\balgebra\b", text):
+        # "algebra" on its own could be either course.
+        confidence -= 0.5
+        text = re.sub(r"\balgebra\b", " ", text)
+
+    qtype = ""
+    for name, pattern in TYPE_PATTERNS:
+        if re.search(pattern, text):
+            qtype = name
+            text = re.sub(pattern, " ", text)
+            break
+
+    if re.search(LIST_PATTERN, text):
+        intent = "list_topics"
+    elif re.search(COUNT_PATTERN, text):
+        intent = "count_questions"
+    else:
+        intent = "generate"
+
+    limit = 0
+    if intent == "generate":
+        limit, explicit = _extract_limit(text)
+        if not explicit and re.search(r"\d", text):
+            confidence -= 0.3
+    text = re.sub(r"\b\d+\b", " ", text)
+    text = re.sub(VAGUE_LIMIT_PATTERN, " ", text)
+
+    leftover = [
+        w for w in re.findall(r"[a-z0-9]+", text)
+        if w not in FILLER_WORDS and w not in NUMBER_WORDS
+    ]
+    topic = ""
+    if intent != "list_topics":
+        topic, ambiguous = _match_topic(topic_tokens(" ".join(leftover)), subject)
+        if ambiguous:
+            confidence -= 0.5
+        elif leftover and not topic:
+            # Something that looks like a topic, but not one we know by name.
+            confidence -= 0.5
+    elif leftover:
+        confidence -= 0.3
+
+    if intent == "generate" and not any([subject, topic, qtype]):
+        confidence -= 0.5
+    if intent == "list_topics" and not subject:
+        confidence -= 0.3
+
+    return (intent, subject, topic, qtype, limit), max(confidence, 0.0)
@@ -0,0 +1,32 @@
+# Random question sampling from the catalogue's id lists (replaces ORDER BY RANDOM() in SQL)
+import random
+
+
+class QuestionSampler:
+    """
+    Draws random question ids from the catalogue's per-filter id lists
+    without scanning or sorting the table.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def sample(self, subject, topic, qtype, limit, seed=None, exclude=()):
+        """
+        Return up to `limit` distinct random ids matching the filters.
+        A seed makes the draw reproducible; ids in `exclude` are skipped.
+        """
+        pool = self.catalog.ids(subject, topic, qtype)
+        rng = random.Random(seed) if seed is not None else random
+        # Over-draw by the number of excluded ids so filtering them out
+        # still leaves `limit` picks, keeping the draw O(limit + excluded).
+        k = min(len(pool), limit + len(exclude))
+        picked = []
+        for idx in rng.sample(range(len(pool)), k):
+            qid = pool[idx]
+            if qid in exclude:
+                continue
+            picked.append(qid)
+            if len(picked) == limit:
+                break
+        return picked
@@ -0,0 +1,202 @@
+# Session persistence: one write transaction per /api/query request, optionally group-committed
+# by a single background writer (SESSION_WRITE_BEHIND=1), and keyset-paginated history reads
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import db
+import metrics
+
+# Group commit: the writer batches whatever arrives within this window, up to GROUP_MAX requests
+GROUP_WINDOW_S = float(os.getenv("SESSION_GROUP_WINDOW_MS", "5")) / 1000
+GROUP_MAX = int(os.getenv("SESSION_GROUP_MAX", "64"))
+
+log = logging.getLogger(__name__)
+
+_latencies = deque(maxlen=2048)  # seconds per write transaction, including the wait for the lock
+_stats_lock = threading.Lock()
+
+
+def _write(conn, session_id, exchange):
+    conn.execute("""
+    INSERT INTO sessions(session_id, last_active)
+        VALUES (?, CURRENT_TIMESTAMP)
+    ON CONFLICT(session_id) DO
+        UPDATE SET last_active = CURRENT_TIMESTAMP
+    """, (session_id,))
+    if exchange is None:
+        return None
+    student_text, bot_text, questions = exchange
+    conn.execute("""
+      INSERT INTO session_messages(session_id, sender, text)
+      VALUES (?, 'student', ?)
+    """, (session_id, student_text))
+    bot_msg_id = conn.execute("""
+      INSERT INTO session_messages(session_id, sender, text)
+      VALUES (?, 'bot', ?)
+    """, (session_id, bot_text)).lastrowid
+    # Only the ids; history hydrates the rows from the question catalogue
+    conn.executemany("""
+    INSERT INTO session_questions
+        (session_id, message_idx, question_idx, question_id)
+    VALUES (?, ?, ?, ?)
+    """, [(session_id, bot_msg_id, i, q["id"]) for i, q in enumerate(questions)])
+    return bot_msg_id
+
+
+def _timed_transaction(records):
+    start = time.perf_counter()
+    with db.transaction() as conn:
+        for session_id, exchange in records:
+            _write(conn, session_id, exchange)
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _latencies.append(elapsed)
+    metrics.SQLITE_QUERY_SECONDS.observe(elapsed, query="session_write")
+
+
+class _WriteBehind:
+    """Single writer thread that drains queued session writes in group commits."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.records = 0
+
+    def submit(self, record):
+        with self._lock:
+            # Threads don't survive a fork, so each gunicorn worker starts its own writer
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+        self._queue.put(record)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + GROUP_WINDOW_S
+            while len(batch) < GROUP_MAX:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [r for r in batch if r is not None]
+            if batch:
+                try:
+                    _timed_transaction(batch)
+                    self.batches += 1
+                    self.records += len(batch)
+                except Exception as e:
+                    log.error("dropped session writes count=%d error=%r", len(batch), e)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+    def depth(self):
+        return self._queue.qsize()
+
+
+_writer = _WriteBehind() if os.getenv("SESSION_WRITE_BEHIND") == "1" else None
+if _writer:
+    # Let queued writes land when gunicorn shuts a worker down
+    atexit.register(_writer.flush)
+
+
+def save(session_id, exchange=None):
+    """
+    Record a request against its session: always bump last_active, and
+    when `exchange` is (student_text, bot_text, questions) also store
+    both messages and the questions, all in one transaction.
+    """
+    if not session_id:
+        return
+    if _writer:
+        _writer.submit((session_id, exchange))
+    else:
+        _timed_transaction([(session_id, exchange)])
+
+
+def latest_message_id(conn, session_id):
+    """Id of the session's newest message (0 if it has none); changes whenever its history does."""
+    return conn.execute(
+        "SELECT MAX(id) FROM session_messages WHERE session_id = ?", (session_id,)
+    ).fetchone()[0] or 0
+
+
+def history_page(conn, session_id, limit, before=None, since=None):
+    """
+    One page of a session's messages in chronological order, each with
+    the ids of its questions. With `since`, the first `limit` messages
+    after that id; otherwise the last `limit` before `before` (or the
+    newest). A limit of None reads every message. Returns (messages,
+    has_more) where has_more says whether another page lies beyond in the
+    direction being read.
+    """
+    # One row past the page tells whether there is more; SQLite reads LIMIT -1 as no limit
+    fetch = -1 if limit is None else limit + 1
+    if since is not None:
+        rows = conn.execute("""
+          SELECT id, sender, text FROM session_messages
+           WHERE session_id = ? AND id > ?
+           ORDER BY id LIMIT ?
+        """, (session_id, since, fetch)).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit]
+    else:
+        rows = conn.execute(f"""
+          SELECT id, sender, text FROM session_messages
+           WHERE session_id = ? {"AND id < ?" if before is not None else ""}
+           ORDER BY id DESC LIMIT ?
+        """, (session_id, *([before] if before is not None else []), fetch)).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    messages = [{"id": r[0], "sender": r[1], "text": r[2], "question_ids": []} for r in rows]
+    if messages:
+        by_id = {m["id"]: m for m in messages}
+        for message_idx, question_id in conn.execute("""
+          SELECT message_idx, question_id FROM session_questions
+           WHERE session_id = ? AND message_idx BETWEEN ? AND ?
+           ORDER BY message_idx, question_idx
+        """, (session_id, messages[0]["id"], messages[-1]["id"])):
+            if message_idx in by_id:
+                by_id[message_idx]["question_ids"].append(question_id)
+    return messages, has_more
+
+
+def stats():
+    with _stats_lock:
+        latencies = sorted(_latencies)
+
+    def pct(p):
+        if not latencies:
+            return 0.0
+        return round(latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000, 2)
+
+    result = {
+        "mode": "write_behind" if _writer else "inline",
+        "transactions": len(latencies),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": pct(1.0),
+    }
+    if _writer:
+        result.update(queue_depth=_writer.depth(), batches=_writer.batches, records=_writer.records)
+    return result
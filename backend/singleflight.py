@@ -0,0 +1,185 @@
+# Request coalescing: concurrent calls for the same key share one execution (one Fireworks parse,
+# one PDF render) instead of each doing the work. Per process, like the parse cache; the SQLite
+# cache tier and the PDF .pending markers are what spread the saving across gunicorn workers.
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+# Longer keys (query texts) are cut down before they become a metric label
+KEY_LABEL_MAX = 64
+
+_groups = []
+
+
+class _Call:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0  # followers blocked on the result right now
+
+
+class _Group:
+    """
+    A named group of keyed calls. The first caller for a key (the leader)
+    runs the work; callers that arrive while it is in flight (followers)
+    wait for and share its result or exception. Nothing is kept once the
+    call finishes, so a later caller runs the work again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.leaders = 0
+        self.followers = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        _groups.append(self)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "waiting": sum(call.waiters for call in self._calls.values()),
+                "leaders": self.leaders,
+                "followers": self.followers,
+            }
+
+    def waiters(self):
+        """{key: followers waiting} for the calls in flight."""
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
+
+    def _forget(self, key, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+
+class SingleFlight(_Group):
+    """Coalesces plain calls, from any number of threads."""
+
+    def do(self, key, fn, *args):
+        """Run fn(*args) or join the call already running for key; returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if shared:
+                self.followers += 1
+            else:
+                self.leaders += 1
+                call = self._calls[key] = _Call(Future())
+        if shared:
+            return self._wait(call, None), True
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._forget(key, call)
+            call.future.set_exception(e)
+            raise
+        self._forget(key, call)
+        call.future.set_result(result)
+        return result, False
+
+    def submit(self, key, executor, fn, *args):
+        """
+        Non-blocking do(): start fn(*args) on the executor unless a call for
+        key is in flight. Returns (future, shared).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.followers += 1
+                return call.future, True
+            self.leaders += 1
+            call = self._calls[key] = _Call(executor.submit(fn, *args))
+        # Outside the lock: an already finished future runs the callback right here
+        call.future.add_done_callback(lambda _: self._forget(key, call))
+        return call.future, False
+
+    def wait(self, key, timeout=None):
+        """
+        Block on the call in flight for key, as a follower, and return its
+        result; None when nothing is running. Raises what the call raised,
+        or TimeoutError.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+        return None if call is None else self._wait(call, timeout)
+
+    def _wait(self, call, timeout):
+        with self._lock:
+            call.waiters += 1
+        try:
+            return call.future.result(timeout)
+        finally:
+            with self._lock:
+                call.waiters -= 1
+
+
+class AsyncSingleFlight(_Group):
+    """Coalesces coroutine functions, used from one event loop; do() is awaited."""
+
+    async def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if shared:
+                self.followers += 1
+                call.waiters += 1
+            else:
+                self.leaders += 1
+                call = self._calls[key] = _Call(asyncio.ensure_future(fn(*args)))
+        if not shared:
+            call.future.add_done_callback(lambda _: self._forget(key, call))
+        try:
+            # Shielded so a caller that goes away (client disconnect) doesn't cancel the call for the rest
+            return await asyncio.shield(call.future), shared
+        finally:
+            if shared:
+                with self._lock:
+                    call.waiters -= 1
+
+
+def stats():
+    """Per group; groups sharing a name (sync and async parse) are summed."""
+    totals = {}
+    for group in list(_groups):
+        into = totals.setdefault(group.name, {})
+        for k, v in group.stats().items():
+            into[k] = into.get(k, 0) + v
+    return totals
+
+
+def _key_label(key):
+    key = str(key)
+    return key if len(key) <= KEY_LABEL_MAX else key[:KEY_LABEL_MAX - 3] + "..."
+
+
+def _waiters_by_key():
+    # Only keys in flight have a series, so cardinality is bounded by concurrent calls
+    values = {}
+    for group in list(_groups):
+        for key, waiting in group.waiters().items():
+            label = (group.name, _key_label(key))
+            values[label] = values.get(label, 0) + waiting
+    return values
+
+
+metrics.Gauge("regents_singleflight_waiters", "Callers waiting on another caller's in-flight call, by key",
+              labels=("group", "key"), collect=_waiters_by_key)
+metrics.Gauge("regents_singleflight_in_flight", "Distinct keys with a call in flight",
+              labels=("group",), collect=lambda: {(name,): s["in_flight"] for name, s in stats().items()})
+metrics.Counter("regents_singleflight_calls_total", "Coalesced calls: leaders ran the work, followers shared it",
+                labels=("group", "role"),
+                collect=lambda: {(name, role): s[role + "s"]
+                                 for name, s in stats().items() for role in ("leader", "follower")})
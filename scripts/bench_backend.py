@@ -0,0 +1,300 @@
+# bench_backend.py
+# Load test for the Flask backend: runs gunicorn against a throwaway copy of regentsqs.db with the
+# Fireworks parser pointed at fake_fireworks.py, drives a weighted mix of /api/query intents plus
+# /api/history and /images, and reports throughput and p50/p95/p99 per endpoint for each
+# workers x threads configuration. Results are saved as JSON; pass --baseline to diff against a run.
+#   python bench_backend.py --configs 1x8,2x4 --duration 30 --concurrency 32 --llm-latency-ms 400
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+import fake_fireworks
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(SCRIPTS_DIR, "..", "backend")
+DB_PATH = os.path.join(BACKEND_DIR, "regentsqs.db")
+RESULTS_DIR = os.path.join(SCRIPTS_DIR, "..", "bench_results")
+
+# {n} is filled with a random count so only some repeats hit the parse cache
+QUERIES = {
+    # answered by the local parser
+    "generate_local": [
+        "{n} algebra ii crqs",
+        "{n} geometry mcqs on similarity transformations",
+        "quiz me on triangle congruence please",
+        "{n} Algebra I MCQs",
+    ],
+    # low local confidence, so these go to the (fake) LLM
+    "generate_llm": [
+        "{n} Algebra I MCQs on exponents",
+        "{n} geometry mcqs on circles",
+        "{n} geometry mcqs on similarity",
+        "give me some practice on circles",
+        "I need help with quadratic stuff",
+        "hard algebra ii questions about logarithms",
+    ],
+    "count": [
+        "How many Geometry CRQs are there?",
+        "how many questions on volume",
+        "How many Algebra I MCQs?",
+    ],
+    "list": [
+        "List Algebra II topics",
+        "what topics are in geometry",
+        "List Algebra I topics",
+    ],
+    "help": ["help", "show me examples"],
+}
+DEFAULT_MIX = "generate_local=30,generate_llm=20,count=15,list=10,help=5,history=10,images=10"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(QUERIES) - {"history", "images"}
+    if unknown:
+        raise SystemExit(f"unknown mix entries: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(p * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def start_server(workers, threads, port, env, log_path):
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        ["gunicorn", "app:app", "-w", str(workers), "-k", "gthread", "--threads", str(threads),
+         "-b", f"127.0.0.1:{port}", "--timeout", "120", "--preload", "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            if requests.get(base + "/healthz", timeout=1).ok:
+                return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    log.close()
+    with open(log_path) as f:
+        tail = f.read()[-2000:]
+    raise SystemExit(f"gunicorn did not come up on {base}:\n{tail}")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+class LoadGenerator:
+    """Closed-loop clients: each thread sends its next request as soon as the last one returns."""
+
+    def __init__(self, base, mix, image_paths, seed):
+        self.base = base
+        if not image_paths and mix.get("images"):
+            # Nothing to request; the share goes to the other kinds rather than failing every client
+            print("[WARN] no question images on disk, dropping 'images' from the mix")
+        mix = {kind: weight for kind, weight in mix.items() if kind != "images" or image_paths}
+        if not mix:
+            raise SystemExit("nothing left in the mix to send")
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.image_paths = image_paths
+        self.seed = seed
+        self.samples = defaultdict(list)  # kind -> [(latency_s, ok)]
+        self._lock = threading.Lock()
+
+    def _one(self, http, rng, session_id, kind):
+        if kind == "history":
+            return http.get(f"{self.base}/api/history/{session_id}", timeout=60)
+        if kind == "images":
+            path = rng.choice(self.image_paths)
+            return http.get(f"{self.base}/{path}", params={"w": 800},
+                            headers={"Accept": "image/webp,image/*"}, timeout=60)
+        text = rng.choice(QUERIES[kind]).format(n=rng.randint(1, 10))
+        return http.post(f"{self.base}/api/query", json={"query": text, "session_id": session_id}, timeout=60)
+
+    def _client(self, index, stop_at, record_from):
+        rng = random.Random(self.seed + index)
+        http = requests.Session()
+        session_id = f"bench-{self.seed}-{index}"
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            kind = rng.choices(self.kinds, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                response = self._one(http, rng, session_id, kind)
+                response.content  # include the time to read the whole body
+                ok = response.status_code < 400
+            except Exception:
+                # Counted like a failed request; an escaping error would end this client's thread unseen
+                ok = False
+            elapsed = time.perf_counter() - start
+            if now >= record_from:
+                with self._lock:
+                    self.samples[kind].append((elapsed, ok))
+
+    def run(self, concurrency, duration, warmup):
+        start = time.monotonic()
+        record_from = start + warmup
+        stop_at = record_from + duration
+        clients = [threading.Thread(target=self._client, args=(i, stop_at, record_from))
+                   for i in range(concurrency)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+
+
+def summarize(samples, duration):
+    report = {}
+    everything = []
+    for kind, values in sorted(samples.items()):
+        latencies = sorted(v[0] for v in values)
+        everything.extend(latencies)
+        report[kind] = {
+            "requests": len(values),
+            "errors": sum(1 for v in values if not v[1]),
+            "rps": round(len(values) / duration, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    everything.sort()
+    report["all"] = {
+        "requests": len(everything),
+        "errors": sum(r["errors"] for r in report.values()),
+        "rps": round(len(everything) / duration, 2),
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(everything, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 2),
+    }
+    return report
+
+
+def print_report(name, report, baseline=None):
+    print(f"\n== {name}")
+    print(f"{'endpoint':<16}{'reqs':>8}{'errs':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, r in report.items():
+        line = (f"{kind:<16}{r['requests']:>8}{r['errors']:>6}{r['rps']:>9.1f}"
+                f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+        before = (baseline or {}).get(kind)
+        if before and before["p95_ms"]:
+            line += f"   p95 {100 * (r['p95_ms'] - before['p95_ms']) / before['p95_ms']:+.0f}%"
+        print(line)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend under gunicorn with a stubbed LLM")
+    parser.add_argument("--configs", default="1x8,2x4,1x16",
+                        help="comma-separated gunicorn WORKERSxTHREADS configurations")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per configuration")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=32, help="closed-loop client threads")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--llm-latency-ms", type=float, default=400)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--db", default=DB_PATH, help="database to copy for the run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="results file (default: bench_results/bench-<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare p95s against")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {run["config"]: run["endpoints"] for run in json.load(f)["runs"]}
+
+    fake = fake_fireworks.start(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                                error_rate=args.llm_error_rate)
+    workdir = tempfile.mkdtemp(prefix="regents-bench-")
+    results = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        "runs": [],
+    }
+    try:
+        for config in args.configs.split(","):
+            workers, threads = (int(x) for x in config.lower().split("x"))
+            # A fresh database and PDF directory per configuration so runs don't warm each other up
+            db_copy = os.path.join(workdir, f"{config}.db")
+            shutil.copy(args.db, db_copy)
+            pdf_dir = os.path.join(workdir, f"{config}-pdf")
+            os.makedirs(pdf_dir)
+            with sqlite3.connect(db_copy) as conn:
+                image_paths = [r[0] for r in conn.execute("SELECT question_image_path FROM questions")
+                               if os.path.exists(os.path.join(BACKEND_DIR, "static", r[0]))]
+            env = dict(os.environ,
+                       REGENTS_DB_PATH=db_copy, OUTPUT_PDF_DIR=pdf_dir,
+                       FIREWORKS_URL=fake.url, FIREWORKS_API_KEY="bench",
+                       JANITOR_INTERVAL_S="0", LOG_LEVEL="WARNING")
+            proc, base = start_server(workers, threads, free_port(), env,
+                                      os.path.join(workdir, f"{config}.log"))
+            calls_before = fake.calls
+            try:
+                generator = LoadGenerator(base, mix, image_paths, args.seed)
+                generator.run(args.concurrency, args.duration, args.warmup)
+            finally:
+                stop_server(proc)
+            report = summarize(generator.samples, args.duration)
+            results["runs"].append({
+                "config": config, "workers": workers, "threads": threads,
+                "llm_calls": fake.calls - calls_before, "endpoints": report,
+            })
+            print_report(f"{config} (workers x threads), {fake.calls - calls_before} LLM calls",
+                         report, baseline.get(config))
+    finally:
+        fake.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n[INFO] Results saved to {out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# build_image_variants.py
+# Offline builder for question image derivatives: quantized PNG/WebP at a few display widths
+# (PDFs embed the widest PNG), with dimensions recorded in regentsqs.db.
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import migrations
+from image_variants import (
+    IMAGES_DIR, VARIANT_FORMATS, VARIANT_WIDTHS,
+    all_variant_names, image_rel_path, variant_name, variant_path,
+)
+
+DB_PATH = "../backend/regentsqs.db"
+# Exam crops are black-and-white scans; 16 grey levels keep anti-aliased text sharp
+PALETTE_COLORS = 16
+
+
+def _resize(img, width):
+    if img.width <= width:
+        return img
+    height = round(img.height * width / img.width)
+    return img.resize((width, height), Image.LANCZOS)
+
+
+def _save(img, path, fmt):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    if fmt == "webp":
+        img.save(tmp, "WEBP", quality=70, method=4)
+    else:
+        img.quantize(colors=PALETTE_COLORS).save(tmp, "PNG", optimize=True)
+    os.replace(tmp, path)
+
+
+def build_one(job):
+    """Build every missing or stale derivative for one question; returns its DB rows."""
+    qid, question_image_path, force = job
+    rel = image_rel_path(question_image_path)
+    src = os.path.join(IMAGES_DIR, rel)
+    if not os.path.exists(src):
+        return qid, None, []
+    src_mtime = os.path.getmtime(src)
+    with Image.open(src) as original:
+        original = original.convert("L")
+        targets = [(variant_name(w, f), w, f) for w in VARIANT_WIDTHS for f in VARIANT_FORMATS]
+        rows = []
+        for variant, width, fmt in targets:
+            path = variant_path(rel, variant)
+            if force or not os.path.exists(path) or os.path.getmtime(path) < src_mtime:
+                _save(_resize(original, width), path, fmt)
+            with Image.open(path) as built:
+                size = built.size
+            rows.append((qid, variant, os.path.relpath(path, os.path.dirname(IMAGES_DIR)),
+                         size[0], size[1], os.path.getsize(path)))
+        return qid, original.size, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build resized WebP/PNG derivatives of question images")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="rebuild derivatives that look up to date")
+    args = parser.parse_args()
+    # Shows the migration log lines from migrations.migrate
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    conn = sqlite3.connect(args.db)
+    migrations.migrate(conn)
+    questions = conn.execute("SELECT id, question_image_path FROM questions ORDER BY id").fetchall()
+    # Drop rows for variants no longer built (the old separate pdf.png copy)
+    names = all_variant_names()
+    conn.execute(f"DELETE FROM question_image_variants WHERE variant NOT IN ({','.join('?' * len(names))})", names)
+
+    start = time.perf_counter()
+    original_bytes = variant_bytes = 0
+    built = missing = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        jobs = [(qid, path, args.force) for qid, path in questions]
+        for qid, size, rows in pool.map(build_one, jobs, chunksize=16):
+            if size is None:
+                missing += 1
+                continue
+            # Only touch rows whose dimensions changed so the catalogue isn't reloaded needlessly
+            conn.execute("""
+                UPDATE questions SET image_width = ?, image_height = ?
+                 WHERE id = ? AND (image_width IS NOT ? OR image_height IS NOT ?)
+            """, (size[0], size[1], qid, size[0], size[1]))
+            conn.executemany("""
+                INSERT OR REPLACE INTO question_image_variants
+                    (question_id, variant, path, width, height, bytes)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            built += 1
+            variant_bytes += sum(r[5] for r in rows if r[1] == variant_name(VARIANT_WIDTHS[-1], "webp"))
+    conn.commit()
+
+    for (path,) in conn.execute("SELECT question_image_path FROM questions"):
+        src = os.path.join(IMAGES_DIR, image_rel_path(path))
+        if os.path.exists(src):
+            original_bytes += os.path.getsize(src)
+    conn.close()
+    print(f"[INFO] {built} questions processed, {missing} missing originals, "
+          f"{time.perf_counter() - start:.1f}s")
+    if original_bytes:
+        print(f"[INFO] originals {original_bytes / 1e6:.1f} MB -> "
+              f"w{VARIANT_WIDTHS[-1]} WebP {variant_bytes / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,17 @@
+import os
+import sys
 import pdfplumber
 import pandas as pd
 import sqlite3
 from PIL import Image
 from surya.recognition import RecognitionPredictor
 from surya.detection import DetectionPredictor
-from run_pipeline import extract_question_text, strip_html_tags
+from run_pipeline import identify_numbers
 
-cluster_map = {
-    "N-RN.B": "The Real Number System",
-    "N-Q.A": "Quantities",
-    "N-QA": "Quantities",
-    "A-SSE.A": "Seeing Structure in Expressions",
-    "A-SSE.B": "Seeing Structure in Expressions",
-    "A-APR.A": "Arithmetic with Polynomials and Rational Expressions",
-    "A-APR.B": "Arithmetic with Polynomials and Rational Expressions",
-    "A-CED.A": "Creating Equations",
-    "A-REI.A": "Reasoning with Equations and Inequalities",
-    "A-REI.B": "Solving One Variable Equations",
-    "A-REI.C": "Systems of Equations",
-    "A-REI.D": "Reasoning with Equations and Inequalities",
-    "F-IF.A": "Interpreting Functions",
-    "F-IF.B": "Interpreting Functions",
-    "F-IF.C": "Interpreting Functions",
-    "F-BF.A": "Building Functions",
-    "F-BF.B": "Building Functions",
-    "F-LE.A": "Linear, Quadratic, and Exponential Models",
-    "F-LE.B": "Linear, Quadratic, and Exponential Models",
-    "S-ID.A": "Interpreting Categorical and Quantitative Data",
-    "S-ID.B": "Interpreting Categorical and Quantitative Data",
-    "S-ID.C": "Interpreting Categorical and Quantitative Data"
-}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from curriculum import CLUSTER_MAPS
+
+cluster_map = CLUSTER_MAPS["Algebra I"]
 DB_PATH = "../backend/regentsqs.db"
 
 def extract_topic_table(PDF_PATH, pgs=[12, 13]):
@@ -77,18 +59,15 @@ def execute():
             if len(topics) == 0:
                 print(f"{month_names[month]} {year}")
                 break
-            for qid, img_path in questions:
-                img = Image.open(f"../backend/{img_path}")
+            # Stored crops have lost their page, so the number comes from OCR of the corner, then the whole crop
+            images = [Image.open(f"../backend/{img_path}") for _, img_path in questions]
+            numbers, sources = identify_numbers(images, predictor, detector)
+            for (qid, img_path), number, source in zip(questions, numbers, sources):
                 print(img_path)
-                try:
-                    ocr_results = predictor([img], det_predictor=detector)
-                    question_text = strip_html_tags(extract_question_text(ocr_results))
-                except:
-                    question_text = ""
-                if not question_text.split(' ')[0].isdigit():
+                if number is None:
                     continue
-                new_topic = topics[question_text.split(' ')[0]]
-                print(f"#: {question_text.split(' ')[0]}, Topic: {new_topic}")
+                new_topic = topics[number]
+                print(f"#: {number} ({source}), Topic: {new_topic}")
                 cur.execute("""
                     UPDATE questions
                     SET topic = ?
@@ -0,0 +1,92 @@
+# fake_fireworks.py
+# Local stand-in for the Fireworks chat-completions endpoint, for benchmarks and offline runs.
+# Answers after a configurable delay with the local rule-based parser's reading of the query.
+#   python fake_fireworks.py --port 8999 --latency-ms 400 --jitter-ms 150
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from query_parser import parse_locally
+
+# build_parse_prompt ends with: Student Query: "<the student's text>"
+QUERY_RE = re.compile(r'Query:\s*"(.*)"\s*$', re.S)
+
+
+class FakeFireworks(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections when hundreds of parses arrive at once
+    request_queue_size = 1024
+
+    def __init__(self, address, latency_ms=400, jitter_ms=0, error_rate=0.0):
+        super().__init__(address, _Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/inference/v1/chat/completions"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        with server._lock:
+            server.calls += 1
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        match = QUERY_RE.search(prompt)
+        (intent, subject, topic, qtype, limit), _ = parse_locally(match.group(1) if match else "")
+
+        delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+        time.sleep(max(delay, 0) / 1000)
+        if random.random() < server.error_rate:
+            self._reply(503, {"error": "fake upstream error"})
+            return
+        content = json.dumps({"intent": intent, "subject": subject, "topic": topic,
+                              "type": qtype, "limit": limit})
+        self._reply(200, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client's read timeout fired first; that is what slow-upstream runs are testing
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(host="127.0.0.1", port=0, **kwargs):
+    """Run a FakeFireworks on a background thread; port 0 picks a free one."""
+    server = FakeFireworks((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-fireworks", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in Fireworks chat-completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--latency-ms", type=float, default=400)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeFireworks((args.host, args.port), args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"[INFO] Fake Fireworks listening on {server.url}")
+    server.serve_forever()
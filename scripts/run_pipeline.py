@@ -1,5 +1,17 @@
 # run_pipeline.py
+# Exam PDF -> question crops + rows in regentsqs.db: YOLO finds the question blocks on each page,
+# each block is read from the PDF text layer, with Surya OCR only for scanned or garbled regions, and
+# the scoring key / rating guide supply answer and topic.
+#   python run_pipeline.py --years 2015-2025 --workers 4 --cpu-threads 16
+import argparse
+import multiprocessing
 import os
+import sys
+import time
+import unicodedata
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from PIL import Image
 from ultralytics import YOLO
 from surya.layout import LayoutPredictor
@@ -19,58 +31,37 @@ import re
 import json
 import subprocess
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from curriculum import CLUSTER_MAPS
+
 DB_PATH = "../backend/regentsqs.db"
 MODEL_PATH = "models/best2.pt"
 OUTPUT_DIR = "../backend/images"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-cluster_map = {
-    "N-RN.A": "Exponents and Radicals",
-    "N-CN.A": "Complex Numbers",
-
-    # Seeing Structure in Expressions
-    "A-SSE.A": "Seeing Structure in Expressions",
-    "A-SSE.B": "Seeing Structure in Expressions",
-
-    # Arithmetic with Polynomials & Rational Expressions
-    "A-APR.B": "Factoring Polynomials",
-    "A-APR.D": "Rational Expressions",
-
-    # Creating Equations
-    "A-CED.A": "Creating Equations",
-
-    # Reasoning with Equations & Inequalities
-    "A-REI.A": "Reasoning with Equations and Inequalities",
-    "A-REI.B": "Solving equations and inequalities in one variable",
-    "A-REI.C": "Solving systems of equations",
-    "A-REI.D": "Graphically solving equations and inequalities",
-
-    # Interpreting Functions
-    "F-IF.A": "Interpreting Functions",
-    "F-IF.B": "Interpreting Functions",
-    "F-IF.C": "Interpreting Functions",
-
-    # Building Functions
-    "F-BF.A": "Building Functions",
-    "F-BF.B": "Building Functions",
-
-    # Linear, Quadratic, and Exponential Models
-    "F-LE.A": "Linear, Quadratic, and Exponential Models",
-    "F-LE.B": "Linear, Quadratic, and Exponential Models",
-
-    # Trigonometric Functions
-    "F-TF.A": "Trigonometric Functions",
-    "F-TF.B": "Modeling with Trigonometric Functions",
-    "F-TF.C": "Trigonometric Identities",
-
-    # Statistics & Probability
-    "S-ID.A": "Interpreting Categorical and Quantitative Data",
-    "S-ID.B": "Interpreting Categorical and Quantitative Data",
-    "S-IC.A": "Making Inferences and Justifying Conclusions",
-    "S-IC.B": "Making Inferences and Justifying Conclusions",
-    "S-CP.A": "Conditional Probability and the Rules of Probability",
-    "S-CP.B": "Conditional Probability and the Rules of Probability",
-}
+# Laid out like regentPDFdownload.py leaves it: exams/<prefix><month><year>-exam.pdf plus the
+# scoring key (-sk) and, when downloaded, the rating guide (-rg) in keys/
+PDF_ROOT = "../pdfs"
+SUBJECT_PREFIXES = {"algone": "Algebra I", "algtwo": "Algebra II", "geo": "Geometry"}
+MONTHS = {1: "January", 6: "June", 8: "August"}
+# Page rasterization resolution; YOLO boxes and the saved crops are both in these pixels
+PAGE_DPI = 300
+# Pages per YOLO call and crops per Surya call; batches keep both models' vectorized kernels busy
+PAGE_BATCH = 4
+OCR_BATCH = 16
+# The item number sits at the top-left of each block; OCR looks at this much of the crop (inches,
+# w x h) before falling back to reading the whole crop
+NUMBER_REGION_IN = (0.9, 0.45)
+# Spans whose tops are this close (points) to a block's topmost span are on its first line
+FIRST_LINE_SLACK_PT = 4
+# YOLO boxes can sit tight on the ink; text this far (points) outside one still belongs to it
+BOX_PAD_PT = 3
+# Symbol and math fonts carry their own encodings, so their runs aren't counted when judging garbling
+MATH_FONT_RE = re.compile(r"math|symbol|mt ?extra|euclid|cmmi|cmsy|cmex", re.I)
+# A region whose text has more than this share of unmapped characters is OCR'd instead
+GARBLED_RATIO = 0.1
+EXAM_NAME_RE = re.compile(r"^(%s)(1|6|8)(20\d\d)-exam\.pdf$" % "|".join(SUBJECT_PREFIXES))
+
+cluster_map = CLUSTER_MAPS["Algebra II"]
 
 def classify_topic(text):
     prompt = f"""Classify the following Algebra I question into only one of the following topics: The Real Number System, Quantities, Seeing Structure in Expressions, Arithmetic with Polynomials and Rational
@@ -106,7 +97,7 @@ Respond with only the topic."""
         print(f"Ollama classification failed: {e}")
         return "unknown"
 
-def extract_topic_table(PDF_PATH, pgs=[12, 13]):
+def extract_topic_table(PDF_PATH, pgs=[12, 13], cluster_map=cluster_map):
     with pdfplumber.open(PDF_PATH) as f:
         if (len(f.pages) < 6):
             return {}
@@ -207,9 +198,11 @@ def strip_html_tags(text):
     
 
 #     print(question_data)
-def insert_question_into_db(subject, topic, month, year, qtype, question_image_path, correct_answer=None, explanation=None):
-    """Insert a question into the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+def insert_question_into_db(subject, topic, month, year, qtype, question_image_path, correct_answer=None, explanation=None, conn=None):
+    """Insert a question into the SQLite database; with `conn` the caller commits."""
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -230,47 +223,73 @@ def insert_question_into_db(subject, topic, month, year, qtype, question_image_p
         datetime.now()
     ))
 
-    conn.commit()
-    conn.close()
-
-def extract_questions_from_pdf(PDF_PATH, KEY_PATH, RG_PATH, month, year):
-    alldata = []
-
-    model = YOLO(MODEL_PATH)
-    predictor = RecognitionPredictor()
-    detector = DetectionPredictor()
-    scoring_key = grabKeyAnswers(KEY_PATH)
-    topics = extract_topic_table(RG_PATH)
-    pdf = fitz.open(PDF_PATH)
-    for page_num in range(len(pdf)):
-        if page_num == 0:
-            continue
-        if page_num > 21:
-            break
-        if "algone82024" in PDF_PATH and page_num < 4:
-            continue
-        print(f"Processing page {page_num + 1}/{len(pdf)}")
-        page = pdf.load_page(page_num)
-        pix = page.get_pixmap(dpi=300)
-        image_path = os.path.join(OUTPUT_DIR, f"page_{page_num}.png")
-        pix.save(image_path)
-
-        full_image = Image.open(image_path)
-        results = model.predict(source=image_path, conf=0.6, save=False)
-        if not results:
-            break
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        classes = results[0].boxes.cls.cpu().numpy().astype(int)
-        names = results[0].names
-        months = {1: "January", 6: "June", 8: "August"}
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+_models = None
+
+def load_models():
+    """YOLO and the Surya predictors, built once per process; loading them is most of a small run."""
+    global _models
+    if _models is None:
+        _models = (YOLO(MODEL_PATH), RecognitionPredictor(), DetectionPredictor())
+    return _models
+
+def pages_to_process(PDF_PATH, page_count):
+    # The cover page and the reference sheets at the back never hold questions
+    first = 4 if "algone82024" in PDF_PATH else 1
+    return range(first, min(page_count, 22))
+
+def rasterize_page(page, dpi=PAGE_DPI):
+    """
+    Render a page to an (h, w, 3) RGB array that is a view of the pixmap's
+    own samples, so nothing is encoded, written or copied. Returns (pixmap,
+    array); the pixmap owns the memory and must outlive the array.
+    """
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    pixels = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    # Rows can be padded, so shape by stride and then trim to the visible width
+    pixels = pixels.reshape(pix.height, pix.stride)[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+    return pix, pixels
+
+def process_pages(pdf, page_nums, month, year, dpi=PAGE_DPI, ocr_batch=OCR_BATCH):
+    """
+    Find, crop and number the question blocks on a batch of pages: one
+    YOLO call for all the pages, read_text_layer for each box, then
+    identify_numbers over every crop. Returns ({page_num: [(number or
+    None, label, cropped_path)] in box order}, timings) where timings
+    counts the crops, the seconds spent on detection and on reading
+    numbers, how many blocks each source read and how many text-layer
+    regions were garbled. Every crop is saved, read or not.
+    """
+    model, predictor, detector = load_models()
+    print(f"Processing pages {page_nums[0] + 1}-{page_nums[-1] + 1}/{len(pdf)}")
+    pages = [pdf.load_page(n) for n in page_nums]
+    rendered = [rasterize_page(page, dpi) for page in pages]
+
+    start = time.perf_counter()
+    # numpy input to YOLO is read as BGR (OpenCV order); this flip is the one full-page copy
+    results = model.predict(source=[np.ascontiguousarray(rgb[..., ::-1]) for _, rgb in rendered],
+                            conf=0.6, save=False)
+    detect_s = time.perf_counter() - start
+
+    crops = []  # (page_num, label, image, cropped_path, TextBlock or None)
+    for page_num, page, (_, page_rgb), result in zip(page_nums, pages, rendered, results):
+        # One text-layer pass per page, without the image payloads "dict" would otherwise carry
+        layout = page.get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES)
+        boxes = result.boxes.xyxy.cpu().numpy()
+        classes = result.boxes.cls.cpu().numpy().astype(int)
+        names = result.names
         for i, (box, cls_id) in enumerate(zip(boxes, classes)):
             label = names[cls_id]  # 'mcqQuestion' or 'saqQuestion'
             if label == "diagram":
                 continue
             x1, y1, x2, y2 = map(int, box)
-            cropped = full_image.crop((x1, y1, x2, y2))
+            # Only the crop's pixels are copied out of the page buffer
+            cropped = Image.fromarray(page_rgb[y1:y2, x1:x2])
 
-            img_filename = f"question_{months[month][:3]}_{year}_{page_num}_{i}_{uuid.uuid4().hex[:8]}.png"
+            img_filename = f"question_{MONTHS[month][:3]}_{year}_{page_num}_{i}_{uuid.uuid4().hex[:8]}.png"
             if page_num == 3 and i == 0:
                 continue
             LABEL_DIR = os.path.join(OUTPUT_DIR, label)
@@ -278,60 +297,329 @@ def extract_questions_from_pdf(PDF_PATH, KEY_PATH, RG_PATH, month, year):
             # Save each cropped question image
             cropped_path = os.path.join(LABEL_DIR, img_filename)
             cropped.save(cropped_path)
-            # Run OCR
-            try:
-                ocr_results = predictor([cropped], det_predictor=detector)
-                question_text = strip_html_tags(extract_question_text(ocr_results))
-            except:
-                question_text = ""
+            # YOLO boxes are in pixels at dpi, the text layer in points
+            block = read_text_layer(layout, fitz.Rect(x1, y1, x2, y2) * (72 / dpi))
+            crops.append((page_num, label, cropped, cropped_path, block))
+
+    start = time.perf_counter()
+    blocks = [c[4] for c in crops]
+    numbers, sources = identify_numbers([c[2] for c in crops], predictor, detector, blocks, ocr_batch, dpi)
+    ocr_s = time.perf_counter() - start
+
+    found = {n: [] for n in page_nums}
+    for (page_num, label, _, cropped_path, _), number in zip(crops, numbers):
+        found[page_num].append((number, label, cropped_path))
+    timings = {"crops": len(crops), "detect_s": detect_s, "ocr_s": ocr_s,
+               "garbled": sum(1 for block in blocks if block is not None and block.garbled)}
+    for source in NUMBER_SOURCES:
+        timings[source] = sources.count(source)
+    return found, timings
+
+def item_number(text):
+    """The item number a block's text starts with, or None."""
+    words = text.split() if text else []
+    return words[0] if words and words[0].isdigit() else None
+
+def _center(bbox):
+    return fitz.Point((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+
+TextBlock = namedtuple("TextBlock", "number garbled")
+
+def read_text_layer(layout, rect):
+    """
+    Read the item number of the block inside rect straight from the
+    page's text layer (page.get_text("dict")): the leftmost span on its
+    first line. None when there is no text there (a scanned page); garbled
+    is set when too much of the text didn't map to real characters, so OCR
+    should read it.
+    """
+    rect = rect + (-BOX_PAD_PT, -BOX_PAD_PT, BOX_PAD_PT, BOX_PAD_PT)
+    spans = [span for block in layout["blocks"] for line in block.get("lines", ())
+             for span in line["spans"]
+             if span["text"].strip() and _center(span["bbox"]) in rect]
+    if not spans:
+        return None
+    words = "".join(span["text"] for span in spans if not MATH_FONT_RE.search(span["font"]))
+    unmapped = sum(1 for c in words if c == "\ufffd" or unicodedata.category(c) in ("Co", "Cn", "Cc"))
+    garbled = not words.strip() or unmapped > GARBLED_RATIO * len(words)
+    # A taller math glyph can start above the item number; both are on the first line
+    top = min(span["bbox"][1] for span in spans)
+    first = min((span for span in spans if span["bbox"][1] - top <= FIRST_LINE_SLACK_PT),
+                key=lambda span: span["bbox"][0])
+    return TextBlock(item_number(first["text"]), garbled)
+
+# Where identify_numbers read each block, cheapest first
+NUMBER_SOURCES = ("text", "corner", "full")
+
+def identify_numbers(images, predictor, detector, blocks=None, batch_size=OCR_BATCH, dpi=PAGE_DPI):
+    """
+    Item numbers for a list of crops, from the cheapest source that gives
+    one: the text layer where `blocks` (from read_text_layer) read a
+    number cleanly, then OCR of only each crop's top-left corner, then OCR
+    of the whole crop. Returns (numbers, sources), None for both where
+    nothing could be read.
+    """
+    numbers = [None] * len(images)
+    sources = [None] * len(images)
+    for k, block in enumerate(blocks or ()):
+        if block is not None and not block.garbled and block.number is not None:
+            numbers[k], sources[k] = block.number, "text"
+    corner_w, corner_h = (int(dpi * inches) for inches in NUMBER_REGION_IN)
+
+    def corner(image):
+        return image.crop((0, 0, min(corner_w, image.width), min(corner_h, image.height)))
+
+    for source, region in (("corner", corner), ("full", lambda image: image)):
+        todo = [k for k, read_by in enumerate(sources) if read_by is None]
+        if not todo:
+            break
+        texts = ocr_crops([region(images[k]) for k in todo], predictor, detector, batch_size)
+        for k, text in zip(todo, texts):
+            numbers[k] = item_number(text)
+            if numbers[k]:
+                sources[k] = source
+    return numbers, sources
+
+def ocr_crops(images, predictor, detector, batch_size=OCR_BATCH):
+    """
+    OCR a list of crops batch_size at a time, returning their texts in
+    input order ("" where OCR failed). Crops are batched with others of
+    similar height so little of each batch is padding.
+    """
+    texts = [""] * len(images)
+    order = sorted(range(len(images)), key=lambda k: images[k].height)
+    for b in range(0, len(order), batch_size):
+        batch = order[b:b + batch_size]
+        try:
+            ocr_results = predictor([images[k] for k in batch], det_predictor=detector)
+        except Exception:
+            # One unreadable crop shouldn't cost the rest of its batch
+            ocr_results = []
+            for k in batch:
+                try:
+                    ocr_results.extend(predictor([images[k]], det_predictor=detector))
+                except Exception:
+                    ocr_results.append(None)
+        for k, ocr in zip(batch, ocr_results):
+            if ocr is not None:
+                texts[k] = strip_html_tags(extract_question_text([ocr]))
+    return texts
+
+def record_questions(found, scoring_key, topics, subject, month, year, conn=None):
+    """
+    Insert the crops process_pages found, in page order, keeping the first
+    crop of each item number. Returns (inserted, skipped).
+    """
+    seen = set()
+    inserted = skipped = 0
+    for num, label, cropped_path in found:
+        if num is None or num in seen:
+            skipped += 1
+            continue
+        seen.add(num)
+        if num not in topics:
+            print(f"No topic for question {num} ({subject} {MONTHS[month]} {year})")
+            skipped += 1
+            continue
+        topic = topics[num]
+        if label == "mcqQuestionBlock":
+            correct_answer = scoring_key[num]
+        elif label == "saqQuestionBlock":
+            correct_answer = "N/A"
+        else:
+            skipped += 1
+            continue
+        insert_question_into_db(
+            subject=subject,
+            topic=topic,
+            month=MONTHS[month],
+            year=year,
+            qtype="MCQ" if label == "mcqQuestionBlock" else "CRQ",
+            question_image_path=cropped_path[11:],
+            correct_answer=correct_answer,
+            explanation=None,
+            conn=conn
+        )
+        inserted += 1
+    return inserted, skipped
 
-            if len(question_text) == 0 or not question_text.split(' ')[0].isdigit():
-                continue
-            if (num := question_text.split(' ')[0]) in alldata:
-                continue
-            alldata.append(num)
-            topic = topics[num]
-            if label == "mcqQuestionBlock":
-                correct_answer = scoring_key[question_text.split(' ')[0]]
-            elif label == "saqQuestionBlock":
-                correct_answer = "N/A"
-            else:
+def extract_questions_from_pdf(PDF_PATH, KEY_PATH, RG_PATH, month, year, subject="Algebra I", dpi=PAGE_DPI,
+                               page_batch=PAGE_BATCH, ocr_batch=OCR_BATCH):
+    scoring_key = grabKeyAnswers(KEY_PATH)
+    topics = extract_topic_table(RG_PATH, cluster_map=CLUSTER_MAPS[subject])
+    pdf = fitz.open(PDF_PATH)
+    found = []
+    for chunk in page_chunks(pages_to_process(PDF_PATH, len(pdf)), page_batch):
+        by_page, _ = process_pages(pdf, chunk, month, year, dpi, ocr_batch)
+        for page_num in chunk:
+            found.extend(by_page[page_num])
+    return record_questions(found, scoring_key, topics, subject, month, year)
+
+def page_chunks(pages, size):
+    pages = list(pages)
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+
+Exam = namedtuple("Exam", "subject month year exam_path key_path rg_path")
+
+def discover_exams(pdf_root=PDF_ROOT, subjects=None, years=None):
+    """
+    Every exam under pdf_root/exams that has a scoring key, oldest first.
+    The topic map is read from the rating guide when there is one and
+    from the scoring key otherwise (older keys carry it themselves).
+    """
+    exams = []
+    exam_dir = os.path.join(pdf_root, "exams")
+    key_dir = os.path.join(pdf_root, "keys")
+    for filename in sorted(os.listdir(exam_dir)):
+        match = EXAM_NAME_RE.match(filename)
+        if not match:
+            continue
+        prefix, month, year = match.group(1), int(match.group(2)), int(match.group(3))
+        subject = SUBJECT_PREFIXES[prefix]
+        if (subjects and subject not in subjects) or (years and year not in years):
+            continue
+        key_path = os.path.join(key_dir, f"{prefix}{month}{year}-sk.pdf")
+        if not os.path.exists(key_path):
+            print(f"Missing scoring key for {filename}")
+            continue
+        rg_path = os.path.join(key_dir, f"{prefix}{month}{year}-rg.pdf")
+        exams.append(Exam(subject, month, year, os.path.join(exam_dir, filename), key_path,
+                          rg_path if os.path.exists(rg_path) else key_path))
+    exams.sort(key=lambda e: (e.year, e.month, e.subject))
+    return exams
+
+_open_pdfs = {}
+
+def _init_worker(threads):
+    # Each worker gets its share of the CPU-thread budget, then pays for the models once
+    import torch
+    torch.set_num_threads(threads)
+    load_models()
+
+def _pages_task(exam, page_nums, dpi, ocr_batch):
+    if exam.exam_path not in _open_pdfs:
+        _open_pdfs.clear()
+        _open_pdfs[exam.exam_path] = fitz.open(exam.exam_path)
+    start = time.time()
+    found, timings = process_pages(_open_pdfs[exam.exam_path], page_nums, exam.month, exam.year, dpi, ocr_batch)
+    return found, timings, start, time.time()
+
+def ingest(exams, workers, cpu_threads, db_path=DB_PATH, dpi=PAGE_DPI, page_batch=PAGE_BATCH, ocr_batch=OCR_BATCH):
+    """
+    Fan the pages of every exam, page_batch at a time, across a process
+    pool and record each exam as soon as its last page is back. The
+    parent is the only DB writer, one transaction per exam.
+    """
+    threads = max(1, cpu_threads // workers)
+    print(f"[INFO] {len(exams)} exams, {workers} workers x {threads} threads, "
+          f"{page_batch} pages per YOLO batch, {ocr_batch} crops per OCR batch")
+    pending = {}
+    for exam in exams:
+        with fitz.open(exam.exam_path) as pdf:
+            todo = pages_to_process(exam.exam_path, len(pdf))
+        if not todo:
+            print(f"[WARN] no question pages in {exam.exam_path}")
+            continue
+        pending[exam] = {"todo": todo, "left": len(todo), "pages": {}, "start": None, "end": 0.0,
+                         "busy": 0.0, "crops": 0, "detect_s": 0.0, "ocr_s": 0.0,
+                         "garbled": 0, **{source: 0 for source in NUMBER_SOURCES}}
+    report = []
+    conn = sqlite3.connect(db_path)
+    started = time.perf_counter()
+    # spawn, not fork: torch's thread pools don't survive a fork of a process that has used them
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(_pages_task, exam, chunk, dpi, ocr_batch): (exam, chunk)
+                   for exam, state in pending.items() for chunk in page_chunks(state["todo"], page_batch)}
+        for future in as_completed(futures):
+            exam, chunk = futures[future]
+            state = pending[exam]
+            try:
+                found, timings, start, end = future.result()
+                state["start"] = min(start, state["start"] or start)
+                state["end"] = max(end, state["end"])
+                state["busy"] += end - start
+                for key in ("crops", "detect_s", "ocr_s", "garbled") + NUMBER_SOURCES:
+                    state[key] += timings[key]
+            except Exception as e:
+                print(f"[ERROR] {exam.exam_path} pages {chunk[0] + 1}-{chunk[-1] + 1}: {e!r}")
+                found = {page_num: [] for page_num in chunk}
+            state["pages"].update(found)
+            state["left"] -= len(chunk)
+            if state["left"]:
                 continue
-            # Save to file or database
-            # print(f"Extracted: {question_text} (Type: {label}, Topic: {topic}, Answer: {correct_answer})")
-            insert_question_into_db(
-                subject="Algebra I",
-                topic=topic,
-                month=months[month],
-                year=year,
-                qtype="MCQ" if label == "mcqQuestionBlock" else "CRQ",
-                question_image_path=cropped_path[11:],
-                correct_answer=correct_answer,
-                explanation=None
-            )
-        if (PG_PATH := os.path.join(OUTPUT_DIR, f"page_{page_num}.png")) and os.path.exists(PG_PATH):
-            os.remove(PG_PATH)
-    #         alldata.append(f"Subject: Algebra I\nTopic: {topic}\nYear: 2025\nType: {label[:3]}\nNumber: {question_text.split(' ')[0]}\nImage Path: {cropped_path}\nCorrect Answer: {correct_answer}\n\n")
-    # with open("questiontext.txt", "w", encoding="utf-8") as f:
-    #     f.writelines(alldata)
+            found = [item for p in sorted(state["pages"]) for item in state["pages"][p]]
+            try:
+                scoring_key = grabKeyAnswers(exam.key_path)
+                topics = extract_topic_table(exam.rg_path, cluster_map=CLUSTER_MAPS[exam.subject])
+                # One transaction per exam: a key that doesn't match leaves nothing half-inserted
+                with conn:
+                    inserted, skipped = record_questions(found, scoring_key, topics, exam.subject,
+                                                         exam.month, exam.year, conn=conn)
+            except Exception as e:
+                print(f"[ERROR] {exam.exam_path}: {e!r}")
+                inserted, skipped = 0, len(found)
+            state.update(pages=len(state["pages"]), inserted=inserted, skipped=skipped,
+                         wall=state["end"] - state["start"] if state["start"] else 0.0)
+            report.append((exam, state))
+            print(f"[INFO] {exam.subject} {MONTHS[exam.month]} {exam.year}: {inserted} questions, "
+                  f"{skipped} skipped, {state['wall']:.1f}s wall")
+    conn.close()
+    print_report(report, time.perf_counter() - started)
+    return report
+
+def print_report(report, total):
+    print(f"\n{'exam':<28}{'pages':>6}{'added':>7}{'skipped':>9}{'wall s':>9}{'page s':>9}"
+          f"{'yolo s':>9}{'crops':>7}{'ocr s':>8}{'crops/s':>9}{'text/corner/full':>18}{'garbled':>9}")
+    for exam, r in report:
+        name = f"{exam.subject} {MONTHS[exam.month]} {exam.year}"
+        rate = r["crops"] / r["ocr_s"] if r["ocr_s"] else 0
+        print(f"{name:<28}{r['pages']:>6}{r['inserted']:>7}{r['skipped']:>9}{r['wall']:>9.1f}{r['busy']:>9.1f}"
+              f"{r['detect_s']:>9.1f}{r['crops']:>7}{r['ocr_s']:>8.1f}{rate:>9.2f}"
+              f"{'/'.join(str(r[source]) for source in NUMBER_SOURCES):>18}{r['garbled']:>9}")
+    pages = sum(r["pages"] for _, r in report)
+    crops = sum(r["crops"] for _, r in report)
+    ocr_s = sum(r["ocr_s"] for _, r in report)
+    print(f"[INFO] {len(report)} exams, {pages} pages, {crops} crops in {total:.1f}s "
+          f"({pages / total if total else 0:.2f} pages/s, {crops / total if total else 0:.2f} crops/s overall, "
+          f"{crops / ocr_s if ocr_s else 0:.2f} crops/s per OCR worker)")
+    text, corner, full, garbled = (sum(r[key] for _, r in report) for key in NUMBER_SOURCES + ("garbled",))
+    print(f"[INFO] blocks: {text} read from the text layer, {corner} by corner OCR, {full} by full OCR; "
+          f"{garbled} text-layer regions were garbled and went to OCR, "
+          f"{crops - text - corner - full} unread")
+
+def _year_range(text):
+    first, _, last = text.partition("-")
+    return range(int(first), int(last or first) + 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest every downloaded Regents exam into regentsqs.db")
+    parser.add_argument("--pdf-root", default=PDF_ROOT)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--subjects", help="comma-separated, e.g. 'Algebra I,Geometry' (default: all)")
+    parser.add_argument("--years", default="2015-2025", help="a year or an inclusive range like 2015-2025")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 4),
+                        help="processes, each with its own copy of the models")
+    parser.add_argument("--cpu-threads", type=int, default=os.cpu_count() or 1,
+                        help="torch threads shared out between the workers")
+    parser.add_argument("--dpi", type=int, default=PAGE_DPI,
+                        help="page render resolution; sets the saved crops' resolution too")
+    parser.add_argument("--page-batch", type=int, default=PAGE_BATCH, help="pages per YOLO call")
+    parser.add_argument("--ocr-batch", type=int, default=OCR_BATCH, help="crops per Surya OCR call")
+    parser.add_argument("--dry-run", action="store_true", help="list the exams that would be ingested")
+    args = parser.parse_args()
+
+    subjects = {s.strip() for s in args.subjects.split(",")} if args.subjects else None
+    exams = discover_exams(args.pdf_root, subjects, _year_range(args.years))
+    if args.dry_run:
+        for exam in exams:
+            print(f"{exam.subject:<12}{MONTHS[exam.month]:<9}{exam.year}  {exam.exam_path}  "
+                  f"{exam.key_path}  {exam.rg_path}")
+        return
+    ingest(exams, args.workers, args.cpu_threads, args.db, args.dpi, args.page_batch, args.ocr_batch)
 
 
 if __name__ == "__main__":
-    months = [8]
-    years = range(2018, 2020)
-    for y in years:
-        for m in months:
-            m_str = f"{m}"
-            y_str = str(y)
-
-            exam_filename = f"algone{m_str}{y_str}-exam.pdf"
-            key_filename = f"algone{m_str}{y_str}-sk.pdf"
-
-            exam_path = os.path.join("../pdfs/exams", exam_filename)
-            key_path = os.path.join("../pdfs/keys", key_filename)
-
-            if os.path.exists(exam_path) and os.path.exists(key_path):
-                print(f"Processing pair: {exam_path}, {key_path}")
-                extract_questions_from_pdf(exam_path, key_path, key_path, m, y)
-            else:
-                print(f"Missing file(s) for {m_str}{y_str}")
\ No newline at end of file
+    main()
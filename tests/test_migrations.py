@@ -0,0 +1,21 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import migrations
+
+
+def test_fresh_db_uses_the_expected_indexes():
+    conn = sqlite3.connect(":memory:")
+    migrations.migrate(conn)
+    assert migrations.schema_version(conn) == len(migrations.MIGRATIONS)
+    # Raises AssertionError if a hot query no longer uses its index
+    migrations.assert_query_plans(conn)
+
+
+def test_migrate_twice_is_a_no_op():
+    conn = sqlite3.connect(":memory:")
+    migrations.migrate(conn)
+    migrations.migrate(conn)
+    migrations.assert_query_plans(conn)
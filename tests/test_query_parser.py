@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from query_parser import MAX_LIMIT, _match_topic, clamp_limit, parse_locally, topic_tokens
+
+# app.LOCAL_PARSE_MIN_CONFIDENCE's default; below it the LLM is asked
+LLM_THRESHOLD = 0.75
+
+
+def test_word_shared_by_several_topics_defers_to_llm():
+    _, confidence = parse_locally("geometry mcq on theorems")
+    assert confidence < LLM_THRESHOLD
+
+
+def test_similarity_alone_defers_to_llm():
+    _, confidence = parse_locally("5 geometry mcqs on similarity")
+    assert confidence < LLM_THRESHOLD
+
+
+def test_full_topic_name_is_not_ambiguous():
+    assert _match_topic(topic_tokens("similarity transformations"), "Geometry") == ("Similarity Transformations", False)
+    (_, _, topic, _, _), confidence = parse_locally("5 algebra 1 mcqs on quantities")
+    assert topic == "Quantities" and confidence == 1.0
+
+
+def test_large_counts_are_capped():
+    (_, _, _, _, limit), _ = parse_locally("show me 100 geometry mcqs")
+    assert limit == MAX_LIMIT
+    assert clamp_limit(-3) == 0